@@ -0,0 +1,194 @@
+"""
+In-process task executor, standing in for Cloud Tasks and the App Engine workers
+
+With `TASK_EXECUTOR=local` the API does not create Cloud Tasks: it imports the imagery and inference
+workers and runs their handlers on local thread pools, one per queue. Together with
+`STORAGE_BACKEND=local` and a product snapshot in `PRODUCT_INDEX_PATH`, the whole
+`/filter` -> `/predict` -> `/task/{id}` flow runs on a single machine, without GCP.
+"""
+from __future__ import annotations
+
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGERY_WORKER_DIR = os.getenv(
+    "IMAGERY_WORKER_DIR", os.path.join(SRC_DIR, "tasks", "imagery")
+)
+INFERENCE_WORKER_DIR = os.getenv(
+    "INFERENCE_WORKER_DIR", os.path.join(SRC_DIR, "tasks", "inference")
+)
+# e.g. "imagery=4,inference=1", queues not listed run LOCAL_DEFAULT_CONCURRENCY tasks at a time
+LOCAL_QUEUE_CONCURRENCY = os.getenv("LOCAL_QUEUE_CONCURRENCY", "")
+LOCAL_DEFAULT_CONCURRENCY = int(os.getenv("LOCAL_DEFAULT_CONCURRENCY", 1))
+LOCAL_MAX_PENDING = int(os.getenv("LOCAL_MAX_PENDING", 100))
+
+# A handler runs a task: handler(queue, task_id, payload), payload being the json task body
+Handler = Callable[[str, str, bytes], None]
+
+
+class QueueFull(Exception):
+    """Raised when a queue already holds as many tasks as it accepts."""
+
+
+class LocalTaskExecutor:
+    """
+    Runs tasks on a thread pool per queue, the way Cloud Tasks would dispatch them to the workers.
+
+    Each queue runs at most its concurrency limit of tasks at a time, and holds at most
+    `max_pending` tasks, queued and running ones included. Tasks over that limit are rejected with
+    `QueueFull` instead of piling up in memory.
+
+    :param handlers: handler of every worker route, e.g. `/imagery`
+    :param concurrency: tasks each queue runs at a time
+    :param default_concurrency: tasks run at a time by the queues missing from `concurrency`
+    :param max_pending: tasks each queue holds at most
+    """
+
+    def __init__(
+        self,
+        handlers: dict[str, Handler],
+        concurrency: Optional[dict[str, int]] = None,
+        default_concurrency: int = LOCAL_DEFAULT_CONCURRENCY,
+        max_pending: int = LOCAL_MAX_PENDING,
+    ):
+        self._handlers = handlers
+        self._concurrency = concurrency or {}
+        self._default_concurrency = default_concurrency
+        self._max_pending = max_pending
+        self._pools = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, queue: str, relative_uri: str, payload: bytes) -> str:
+        """
+        Queues a task. Returns right away, like Cloud Tasks does.
+
+        :param queue: queue to run the task in
+        :param relative_uri: worker route handling the task
+        :param payload: json body of the task
+        :returns: task id
+        """
+        if relative_uri not in self._handlers:
+            raise ValueError(f"No worker handles {relative_uri}")
+        with self._lock:
+            if self._pending.get(queue, 0) >= self._max_pending:
+                raise QueueFull(f"Queue {queue} already holds {self._max_pending} tasks")
+            self._pending[queue] = self._pending.get(queue, 0) + 1
+            pool = self._pools.get(queue)
+            if pool is None:
+                pool = self._pools[queue] = ThreadPoolExecutor(
+                    max_workers=self._concurrency.get(queue, self._default_concurrency),
+                    thread_name_prefix=f"queue-{queue}",
+                )
+        task_id = uuid.uuid4().hex
+        pool.submit(self._run, self._handlers[relative_uri], queue, task_id, payload)
+        return task_id
+
+    def pending(self, queue: str) -> int:
+        """Returns the number of tasks queued or running in `queue`."""
+        with self._lock:
+            return self._pending.get(queue, 0)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stops every pool, after running their queued tasks when `wait` is set."""
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+    def _run(self, handler: Handler, queue: str, task_id: str, payload: bytes) -> None:
+        try:
+            handler(queue, task_id, payload)
+        except Exception:  # pylint: disable=broad-except
+            # the worker recorded the failure in the status store, as it does for Cloud Tasks
+            logger.exception("Task %s/%s failed", queue, task_id)
+        finally:
+            with self._lock:
+                self._pending[queue] -= 1
+
+
+def parse_concurrency(spec: str) -> dict[str, int]:
+    """Parses a `queue=limit,...` concurrency spec, e.g. `imagery=4,inference=1`."""
+    concurrency = {}
+    for item in filter(None, (item.strip() for item in spec.split(","))):
+        queue, _, limit = item.partition("=")
+        concurrency[queue.strip()] = int(limit)
+    return concurrency
+
+
+def load_worker(name: str, directory: str):
+    """
+    Imports the `main` module of a worker under another name, so it does not shadow the API's.
+
+    The worker directory is appended to `sys.path` for the modules the worker imports itself.
+
+    :param name: module name the worker is imported as
+    :param directory: worker directory, as deployed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if directory not in sys.path:
+        sys.path.append(directory)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
+
+
+def flask_handler(app, relative_uri: str) -> Handler:
+    """
+    Wraps a route of a worker Flask app into a handler.
+
+    Tasks are posted with the headers App Engine sets on Cloud Tasks requests, so the worker
+    records their status exactly as when it is deployed.
+    """
+
+    def handle(queue: str, task_id: str, payload: bytes) -> None:
+        with app.test_client() as worker:
+            response = worker.post(
+                relative_uri,
+                data=payload,
+                headers={
+                    "Content-type": "application/json",
+                    "X-Appengine-Queuename": queue,
+                    "X-Appengine-Taskname": task_id,
+                },
+            )
+        if response.status_code >= 300:
+            raise RuntimeError(f"{relative_uri} answered {response.status_code}")
+
+    return handle
+
+
+def local_executor(bucket_name: str) -> LocalTaskExecutor:
+    """
+    Creates an executor running the imagery and inference workers in this process.
+
+    :param bucket_name: bucket the workers read and write, the one the API reads statuses from
+    """
+    os.environ.setdefault("BUCKET_NAME", bucket_name)
+    imagery_worker = load_worker("imagery_worker", IMAGERY_WORKER_DIR)
+    inference_worker = load_worker("inference_worker", INFERENCE_WORKER_DIR)
+    return LocalTaskExecutor(
+        handlers={
+            "/imagery": flask_handler(imagery_worker.app, "/imagery"),
+            "/inference": flask_handler(inference_worker.app, "/inference"),
+        },
+        concurrency=parse_concurrency(LOCAL_QUEUE_CONCURRENCY),
+    )
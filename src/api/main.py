@@ -1,19 +1,64 @@
 # pylint: disable=too-few-public-methods,import-error,no-name-in-module
 """Defines the image classifier API"""
-from typing import Optional
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from google.cloud import tasks_v2
-from pydantic import BaseModel
-from starlette.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from pydantic import BaseModel, conint
+from starlette.responses import JSONResponse, Response
+
+from common.cache import TTLCache
+from common.metrics import counter, histogram
+from common.status import PENDING, TERMINAL_STATUSES, TaskStatusStore
 
 PROJECT_ID = "tcc-lucas-pierre"
 LOCATION = "southamerica-east1"
+BUCKET_NAME = os.getenv("BUCKET_NAME", "tcc-clothes")
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", 32))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 1000))
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", 0.5))
+STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", 10000))
+FINISHED_STATUS_CACHE_TTL = 3600
+LONG_POLL_INTERVAL = float(os.getenv("LONG_POLL_INTERVAL", 0.25))
+MAX_LONG_POLL_TIMEOUT = 60
+# `cloud-tasks` dispatches to the App Engine workers, `local` runs them in-process (executor.py)
+TASK_EXECUTOR = os.getenv("TASK_EXECUTOR", "cloud-tasks")
+
+if TASK_EXECUTOR == "local":
+    from executor import QueueFull, local_executor  # pylint: disable=wrong-import-position
+
+    client = None
+    executor = local_executor(BUCKET_NAME)
+else:
+    client = tasks_v2.CloudTasksClient()
+    executor = None
+# Cloud Tasks calls are blocking, they run here instead of on the event loop
+dispatcher = ThreadPoolExecutor(max_workers=DISPATCH_CONCURRENCY)
+status_store = TaskStatusStore(BUCKET_NAME)
+status_cache = TTLCache(maxsize=STATUS_CACHE_SIZE, ttl=STATUS_CACHE_TTL)
 
-client = tasks_v2.CloudTasksClient()
+DISPATCH_SECONDS = histogram(
+    "api_dispatch_seconds", "Time to create a task, per queue", ["queue"]
+)
+DISPATCH_ERRORS = counter(
+    "api_dispatch_errors", "Tasks that could not be created, per queue", ["queue"]
+)
+STATUS_LOOKUPS = counter(
+    "api_status_lookups", "Task status lookups, per source: cache or store", ["source"]
+)
 
 app = FastAPI()
 
+if executor is not None:
+
+    @app.exception_handler(QueueFull)
+    async def queue_full(request, error):  # pylint: disable=unused-argument
+        return JSONResponse({"detail": str(error)}, status_code=429)
+
 
 class ImageryModel(BaseModel):
     """Defines attributes for imagery model"""
@@ -37,6 +82,36 @@ class InferenceModel(BaseModel):
 
     queue: str
     task_id: str
+    model_uri: Optional[str] = None
+    batch_size: Optional[conint(ge=1)] = None
+    num_workers: Optional[conint(ge=0)] = None
+    prefetch_factor: Optional[conint(ge=1)] = None
+    top_k: Optional[conint(ge=0)] = None
+
+
+def lookup_status(task_id: str, queue: str) -> dict:
+    """
+    Returns the status record the workers wrote for a task, through a short lived cache.
+
+    Finished tasks are cached for much longer since their status cannot change anymore. Tasks
+    without a record have not been picked up by a worker yet and are reported as PENDING.
+
+    :param task_id: Cloud Task id
+    :param queue: queue the task was dispatched to
+    """
+    record = status_cache.get((queue, task_id))
+    STATUS_LOOKUPS.labels(source="cache" if record is not None else "store").inc()
+    if record is None:
+        record = status_store.get(queue, task_id) or {
+            "task_id": task_id,
+            "queue": queue,
+            "status": PENDING,
+        }
+        finished = record["status"] in TERMINAL_STATUSES
+        status_cache.set(
+            (queue, task_id), record, ttl=FINISHED_STATUS_CACHE_TTL if finished else None
+        )
+    return record
 
 
 @app.get("/task/{task_id}", status_code=200)
@@ -46,45 +121,130 @@ def get_task_result(task_id: str, queue: str):
 
     :param task_id: Cloud Task id
     :param queue: queue to fetch task id status
+    :returns: PENDING, RUNNING, SUCCESS or FAILED status, with the task timings once started
     """
-    try:
-        req = tasks_v2.GetTaskRequest(
-            name=f"projects/{PROJECT_ID}/locations/{LOCATION}/queues/{queue}/tasks/{task_id}",
-        )
-        response = client.get_task(request=req)
-        first_attempt = response.first_attempt if response.first_attempt else None
-        status = "FAILED" if first_attempt else "PENDING"
-        return JSONResponse({"status": status})
-    except Exception:
-        return JSONResponse({"status": "SUCCESS"})
+    return JSONResponse(lookup_status(task_id, queue))
 
 
-@app.post("/filter", status_code=201)
-async def imagery(data: ImageryModel):
+@app.get("/metrics")
+def metrics():
+    """Metrics of this API process, in the Prometheus text format."""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/task/{task_id}/wait", status_code=200)
+async def wait_task_result(task_id: str, queue: str, timeout: float = 30):
     """
-    Creates async Cloud Task for imagery worker.
+    Long-polls the status of a task: answers as soon as the task finishes, or after `timeout`
+    seconds with its current status.
 
-    :param data: request input
+    :param task_id: Cloud Task id
+    :param queue: queue to fetch task id status
+    :param timeout: maximum time to wait, in seconds
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(timeout, MAX_LONG_POLL_TIMEOUT)
+    while True:
+        record = await loop.run_in_executor(None, lookup_status, task_id, queue)
+        if record["status"] in TERMINAL_STATUSES or loop.time() >= deadline:
+            return JSONResponse(record)
+        await asyncio.sleep(LONG_POLL_INTERVAL)
+
+
+def create_task(queue: str, relative_uri: str, payload: bytes) -> str:
+    """
+    Creates a Cloud Task for a worker. Blocks until Cloud Tasks answers.
+
+    With the local executor, the task is queued to the worker running in this process instead.
+
+    :param queue: queue to create the task in
+    :param relative_uri: worker route handling the task
+    :param payload: json body of the task
     :returns: Cloud Task id
     """
+    if executor is not None:
+        return executor.submit(queue, relative_uri, payload)
+
     task = {
         "app_engine_http_request": {  # Specify the type of request.
             "http_method": tasks_v2.HttpMethod.POST,
-            "relative_uri": "/imagery",
+            "relative_uri": relative_uri,
         }
     }
     task["app_engine_http_request"]["headers"] = {"Content-type": "application/json"}
+    task["app_engine_http_request"]["body"] = payload
+    parent = client.queue_path(PROJECT_ID, LOCATION, queue)
+
+    response = client.create_task(parent=parent, task=task)
+
+    return response.name.split("tasks/")[1]
+
+
+async def dispatch(data: BaseModel, relative_uri: str) -> dict:
+    """
+    Creates a Cloud Task without blocking the event loop.
+
+    :param data: request input, sent as the task body
+    :param relative_uri: worker route handling the task
+    :returns: Cloud Task id and queue
+    """
     queue = data.dict().get("queue")
-    print(queue)
-    converted_payload = data.json().encode("utf-8")
-    task["app_engine_http_request"]["body"] = converted_payload
-    parent_imagery = client.queue_path(PROJECT_ID, LOCATION, queue)
+    loop = asyncio.get_running_loop()
+    try:
+        with DISPATCH_SECONDS.labels(queue=queue).time():
+            task_id = await loop.run_in_executor(
+                dispatcher, create_task, queue, relative_uri, data.json().encode("utf-8")
+            )
+    except Exception:
+        DISPATCH_ERRORS.labels(queue=queue).inc()
+        raise
+    return {"task_id": task_id, "queue": queue}
 
-    response = client.create_task(parent=parent_imagery, task=task)
 
-    return JSONResponse(
-        {"task_id": response.name.split("tasks/")[1], "queue": queue}
+async def dispatch_batch(items: List[BaseModel], relative_uri: str) -> list:
+    """
+    Creates Cloud Tasks for many inputs concurrently.
+
+    A failing input does not fail the others, its entry holds the error instead of a task id.
+
+    :param items: request inputs
+    :param relative_uri: worker route handling the tasks
+    """
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"At most {MAX_BATCH_SIZE} items per batch"
+        )
+    results = await asyncio.gather(
+        *(dispatch(item, relative_uri) for item in items), return_exceptions=True
     )
+    return [
+        {"error": str(result), "queue": item.dict().get("queue")}
+        if isinstance(result, Exception)
+        else result
+        for item, result in zip(items, results)
+    ]
+
+
+@app.post("/filter", status_code=201)
+async def imagery(data: ImageryModel):
+    """
+    Creates async Cloud Task for imagery worker.
+
+    :param data: request input
+    :returns: Cloud Task id
+    """
+    return JSONResponse(await dispatch(data, "/imagery"))
+
+
+@app.post("/filter/batch", status_code=201)
+async def imagery_batch(data: List[ImageryModel]):
+    """
+    Creates async Cloud Tasks for the imagery worker, one per input.
+
+    :param data: request inputs
+    :returns: Cloud Task id and queue of every input, in order
+    """
+    return JSONResponse(await dispatch_batch(data, "/imagery"))
 
 
 @app.post("/predict", status_code=201)
@@ -94,19 +254,15 @@ async def inference(data: InferenceModel):
 
     :param data: request input
     """
-    queue = data.dict().get("queue")
-    print(queue)
-    parent_inference = client.queue_path(PROJECT_ID, LOCATION, queue)
+    return JSONResponse(await dispatch(data, "/inference"))
 
-    task = {
-        "app_engine_http_request": {  # Specify the type of request.
-            "http_method": tasks_v2.HttpMethod.POST,
-            "relative_uri": "/inference",
-        }
-    }
-    task["app_engine_http_request"]["headers"] = {"Content-type": "application/json"}
-    converted_payload = data.json().encode("utf-8")
-    task["app_engine_http_request"]["body"] = converted_payload
-    response = client.create_task(parent=parent_inference, task=task)
 
-    return JSONResponse({"task_id": response.name.split("tasks/")[1], "queue": queue})
+@app.post("/predict/batch", status_code=201)
+async def inference_batch(data: List[InferenceModel]):
+    """
+    Creates async Cloud Tasks for the inference worker, one per input.
+
+    :param data: request inputs
+    :returns: Cloud Task id and queue of every input, in order
+    """
+    return JSONResponse(await dispatch_batch(data, "/inference"))
@@ -1,10 +1,17 @@
-"""Create pytest fixture"""
-import pytest
-from fastapi.testclient import TestClient
-from fastapi import FastAPI
-from src.api.main import app
-
-
-@pytest.fixture(scope="session", autouse=True)
-def client():
-    return TestClient(app)
+"""Create pytest fixture"""
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+from fastapi import FastAPI
+
+# The API is deployed next to a copy of src/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.api.main import app  # noqa: E402 pylint: disable=wrong-import-position
+
+
+@pytest.fixture(scope="session", autouse=True)
+def client():
+    return TestClient(app)
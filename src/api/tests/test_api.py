@@ -1,4 +1,5 @@
 """Unit tests"""
+import pytest
 
 
 def test_filter_valid_request(client):
@@ -37,3 +38,83 @@ def test_filter_invalid_request(client):
             },
         ]
     }
+
+
+def test_filter_batch_creates_one_task_per_payload(client, monkeypatch):
+    """Every payload of a batch should get its own task, in request order"""
+    created = []
+
+    def create_task(queue, relative_uri, payload):
+        created.append((queue, relative_uri))
+        return f"task-{len(created)}"
+
+    monkeypatch.setattr("src.api.main.create_task", create_task)
+    body = [{"queue": "imagery", "gender": "Men"}, {"queue": "imagery-dev", "gender": "Women"}]
+
+    response = client.post("/filter/batch", json=body)
+
+    assert response.status_code == 200
+    assert [item["queue"] for item in response.json()] == ["imagery", "imagery-dev"]
+    assert sorted(created) == [("imagery", "/imagery"), ("imagery-dev", "/imagery")]
+
+
+def test_predict_batch_reports_failed_payloads(client, monkeypatch):
+    """A failing dispatch should be reported without failing the rest of the batch"""
+
+    def create_task(queue, relative_uri, payload):
+        if queue == "broken":
+            raise RuntimeError("queue not found")
+        return "task-1"
+
+    monkeypatch.setattr("src.api.main.create_task", create_task)
+    body = [{"queue": "inference", "task_id": "a"}, {"queue": "broken", "task_id": "b"}]
+
+    response = client.post("/predict/batch", json=body)
+
+    assert response.json() == [
+        {"task_id": "task-1", "queue": "inference"},
+        {"error": "queue not found", "queue": "broken"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "field, value", [("top_k", -1), ("batch_size", 0), ("num_workers", -1), ("prefetch_factor", 0)]
+)
+def test_predict_rejects_out_of_range_options(client, field, value):
+    """Options below their minimum do not pass pydantic validation, should be bad request"""
+    response = client.post("/predict", json={"queue": "inference", "task_id": "a", field: value})
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", field]
+
+
+def test_task_status_comes_from_the_status_store(client, monkeypatch, tmp_path):
+    """Unknown tasks are pending, then the status the workers recorded is reported"""
+    from common.cache import TTLCache
+    from common.status import TaskStatusStore
+    from common.storage import LocalGateway
+
+    store = TaskStatusStore("bucket", gateway=LocalGateway(str(tmp_path)))
+    monkeypatch.setattr("src.api.main.status_store", store)
+    monkeypatch.setattr("src.api.main.status_cache", TTLCache(maxsize=10, ttl=0))
+
+    pending = client.get("/task/123", params={"queue": "imagery"}).json()
+    with store.track("imagery", "123"):
+        running = client.get("/task/123", params={"queue": "imagery"}).json()
+    done = client.get("/task/123/wait", params={"queue": "imagery", "timeout": 5}).json()
+
+    assert pending["status"] == "PENDING"
+    assert running["status"] == "RUNNING"
+    assert done["status"] == "SUCCESS"
+    assert done["duration_s"] >= 0
+
+
+def test_metrics_expose_dispatch_latency(client, monkeypatch):
+    """Dispatched tasks should show up in the Prometheus metrics of the API"""
+    monkeypatch.setattr("src.api.main.create_task", lambda *args: "task-1")
+    client.post("/predict", json={"queue": "inference-metrics", "task_id": "a"})
+
+    response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'api_dispatch_seconds_count{queue="inference-metrics"} 1' in response.text
@@ -0,0 +1,75 @@
+"""Unit tests of the in-process task executor"""
+import json
+import threading
+import time
+
+import pytest
+
+from src.api.executor import LocalTaskExecutor, QueueFull, parse_concurrency
+
+
+def test_tasks_run_on_their_route_handler():
+    """Every task is handled by the handler of its route, with its queue, id and payload"""
+    handled = []
+    done = threading.Event()
+
+    def handler(queue, task_id, payload):
+        handled.append((queue, task_id, json.loads(payload)))
+        done.set()
+
+    executor = LocalTaskExecutor({"/imagery": handler})
+    task_id = executor.submit("imagery", "/imagery", b'{"gender": "Men"}')
+
+    assert done.wait(5)
+    executor.shutdown()
+    assert handled == [("imagery", task_id, {"gender": "Men"})]
+    assert executor.pending("imagery") == 0
+    with pytest.raises(ValueError):
+        executor.submit("imagery", "/unknown", b"{}")
+
+
+def test_queues_are_bounded_and_limited_independently():
+    """A full queue rejects tasks, without running more than its concurrency limit at once"""
+    release = threading.Event()
+    running = []
+    lock = threading.Lock()
+    peak = {}
+
+    def handler(queue, task_id, payload):
+        with lock:
+            running.append(queue)
+            peak[queue] = max(peak.get(queue, 0), running.count(queue))
+        release.wait(5)
+        with lock:
+            running.remove(queue)
+
+    executor = LocalTaskExecutor(
+        {"/inference": handler}, concurrency={"inference": 2}, max_pending=3
+    )
+    for _ in range(3):
+        executor.submit("inference", "/inference", b"{}")
+    with pytest.raises(QueueFull):
+        executor.submit("inference", "/inference", b"{}")
+    executor.submit("inference-dev", "/inference", b"{}")
+
+    deadline = time.monotonic() + 5
+    while sorted(running) != ["inference", "inference", "inference-dev"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    release.set()
+    executor.shutdown()
+    assert peak == {"inference": 2, "inference-dev": 1}
+    assert executor.pending("inference") == 0
+
+
+def test_failing_tasks_free_their_slot():
+    executor = LocalTaskExecutor({"/imagery": lambda *args: 1 / 0}, max_pending=1)
+    executor.submit("imagery", "/imagery", b"{}")
+    executor.shutdown()
+
+    assert executor.pending("imagery") == 0
+
+
+def test_parse_concurrency():
+    assert parse_concurrency("imagery=4, inference=1,") == {"imagery": 4, "inference": 1}
+    assert parse_concurrency("") == {}
@@ -0,0 +1,31 @@
+"""Synthetic inputs shared by the benchmark suites"""
+from __future__ import annotations
+
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_jpeg(width: int, height: int, seed: int = 0) -> bytes:
+    """
+    Encodes a smooth random image as a jpeg.
+
+    Smooth images compress and decode like product photos, unlike uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 255, size=(height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((width, height), Image.BILINEAR)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def upload_jpegs(gateway, bucket_name: str, prefix: str, count: int, width: int, height: int):
+    """Uploads `count` synthetic jpegs as `<prefix><i>.jpg` and returns their blob names."""
+    names = []
+    for i in range(count):
+        name = f"{prefix}{i}.jpg"
+        gateway.upload(bucket_name, name, synthetic_jpeg(width, height, seed=i))
+        names.append(name)
+    return names
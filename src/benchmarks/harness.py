@@ -0,0 +1,131 @@
+"""Timing, reporting and baseline comparison of the benchmark suites"""
+from __future__ import annotations
+
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+from typing import Callable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+class Benchmark(NamedTuple):
+    """
+    A timed callable.
+
+    :param name: name of the benchmark within its suite
+    :param func: callable without arguments, everything it needs is set up beforehand
+    :param repeat: number of timed rounds, the median round is reported
+    :param number: calls per round, to time calls that are too fast to time alone
+    """
+
+    name: str
+    func: Callable[[], object]
+    repeat: int = 5
+    number: int = 1
+
+
+def measure(benchmark: Benchmark, warmup: int = 1) -> dict:
+    """
+    Times a benchmark.
+
+    :param benchmark: benchmark to time
+    :param warmup: untimed calls made first, to fill caches and pools
+    :return: seconds per call, over all the rounds
+    """
+    for _ in range(warmup):
+        benchmark.func()
+    rounds = []
+    for _ in range(benchmark.repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(benchmark.number):
+            benchmark.func()
+        rounds.append((time.perf_counter() - start) / benchmark.number)
+    return {
+        "median_s": statistics.median(rounds),
+        "min_s": min(rounds),
+        "max_s": max(rounds),
+        "repeat": benchmark.repeat,
+        "number": benchmark.number,
+    }
+
+
+def run_suite(suite: str, benchmarks: list[Benchmark], only: Optional[list[str]] = None) -> dict:
+    """
+    Times every benchmark of a suite.
+
+    :param suite: name of the suite
+    :param benchmarks: benchmarks of the suite
+    :param only: names of the benchmarks to run, all of them when omitted
+    :return: machine-readable results of the suite
+    """
+    results = {}
+    for benchmark in benchmarks:
+        if only and benchmark.name not in only:
+            continue
+        results[benchmark.name] = measure(benchmark)
+        logger.info("%s.%s: %.6fs", suite, benchmark.name, results[benchmark.name]["median_s"])
+    return {
+        "suite": suite,
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        "benchmarks": results,
+    }
+
+
+def baseline_path(suite: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{suite}.json")
+
+
+def load_baseline(suite: str) -> Optional[dict]:
+    """Returns the stored baseline of a suite, or None if there is none."""
+    path = baseline_path(suite)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(results: dict) -> str:
+    """Stores results as the baseline of their suite, and returns its path."""
+    path = baseline_path(results["suite"])
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump(results, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+    return path
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> dict:
+    """
+    Compares results with a baseline.
+
+    A benchmark regresses when its median is more than `tolerance` times the baseline median.
+
+    :param results: results of a suite
+    :param baseline: baseline of the same suite
+    :param tolerance: allowed slowdown ratio, e.g. 1.25
+    :return: ratio to the baseline of every benchmark both have, and the names of the regressions
+    """
+    ratios = {}
+    for name, stats in results["benchmarks"].items():
+        reference = baseline["benchmarks"].get(name)
+        if reference is not None and reference["median_s"] > 0:
+            ratios[name] = stats["median_s"] / reference["median_s"]
+    return {
+        "tolerance": tolerance,
+        "ratios": ratios,
+        "regressions": sorted(name for name, ratio in ratios.items() if ratio > tolerance),
+    }
@@ -0,0 +1,96 @@
+"""Benchmarks of the imagery worker hot paths"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.join(SRC_DIR, "tasks", "imagery"))
+
+# pylint: disable=wrong-import-position,import-error
+from augmentation import augment, run_pipeline  # noqa: E402
+from benchmarks.data import synthetic_jpeg, upload_jpegs  # noqa: E402
+from benchmarks.harness import Benchmark  # noqa: E402
+from common.storage import LocalGateway  # noqa: E402
+from product_index import ProductIndex, write_snapshot  # noqa: E402
+from products import ProductFilter  # noqa: E402
+
+# Augmentation config the CD4ML pipeline sends along with its imagery tasks
+AUG_CONF = {
+    "albumentation": {
+        "input_image": {"width": 60, "height": 80},
+        "cropping": {"height": {"min": 10, "max": 70}},
+        "resize": {"width": 256, "height": 256},
+    }
+}
+# RandomSizedCrop crops squares of up to 70 pixels, so images must be wider than `input_image`
+IMAGE_SIZE = (96, 128)
+PIPELINE_IMAGES = 64
+SNAPSHOT_PRODUCTS = 44000
+
+
+def pipeline(gateway, image_ids):
+    def run():
+        failed = run_pipeline(
+            image_ids,
+            AUG_CONF,
+            fetch=lambda image_id: gateway.download("bench", f"images/{image_id}.jpg"),
+            store=lambda image_id, img: gateway.upload("bench", f"augmented/{image_id}.jpg", img),
+            processes=0,
+        )
+        assert not failed, failed
+
+    return run
+
+
+def product_snapshot(path):
+    rng = random.Random(0)
+    choices = {
+        "gender": ["Men", "Women", "Boys", "Girls", "Unisex"],
+        "master_category": [f"master-{i}" for i in range(7)],
+        "sub_category": [f"sub-{i}" for i in range(45)],
+        "article_type": [f"article-{i}" for i in range(140)],
+        "base_colour": [f"colour-{i}" for i in range(46)],
+        "season": ["Summer", "Fall", "Winter", "Spring"],
+        "usage": [f"usage-{i}" for i in range(8)],
+    }
+    products = [
+        dict(
+            {column: rng.choice(values) for column, values in choices.items()},
+            image_id=image_id,
+            year=rng.randrange(2007, 2019),
+            display_name=f"product {image_id}",
+        )
+        for image_id in range(SNAPSHOT_PRODUCTS)
+    ]
+    write_snapshot(products, path)
+    return ProductIndex(path)
+
+
+def benchmarks() -> list[Benchmark]:
+    workdir = tempfile.mkdtemp(prefix="bench-imagery-")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    gateway = LocalGateway(workdir)
+    aug_conf_json = json.dumps(AUG_CONF, sort_keys=True)
+    image = synthetic_jpeg(*IMAGE_SIZE)
+    upload_jpegs(gateway, "bench", "images/", PIPELINE_IMAGES, *IMAGE_SIZE)
+    index = product_snapshot(os.path.join(workdir, "products_snapshot"))
+    product_filter = ProductFilter(
+        gender="Women", sub_category="sub-3", start_year=2012, end_year=2012, limit=10
+    )
+    year_range_filter = ProductFilter(gender="Women", start_year=2010, end_year=2015, limit=1000)
+
+    return [
+        Benchmark("augment", lambda: augment(image, aug_conf_json, 42), number=50),
+        Benchmark("run_pipeline_inline", pipeline(gateway, range(PIPELINE_IMAGES))),
+        Benchmark("product_index_filter", lambda: index.filter(product_filter), number=100),
+        Benchmark(
+            "product_index_year_range", lambda: index.filter(year_range_filter), number=20
+        ),
+    ]
@@ -0,0 +1,115 @@
+"""Benchmarks of the inference worker hot paths"""
+from __future__ import annotations
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.join(SRC_DIR, "tasks", "inference"))
+
+# pylint: disable=wrong-import-position,import-error
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+
+from benchmarks.data import upload_jpegs  # noqa: E402
+from benchmarks.harness import Benchmark  # noqa: E402
+from common.results import ResultWriter  # noqa: E402
+from common.storage import LocalGateway, set_gateway  # noqa: E402
+from deepfashion import (  # noqa: E402
+    N_LANDMARKS,
+    FashionNetVgg16NoBn,
+    gated_roi_pooling,
+    landmark_predictions_to_roipool_boxes,
+)
+from utils.dataset import ImagesDataset, to_float  # noqa: E402
+
+FORWARD_BATCH_SIZES = (1, 4, 8)
+DATASET_IMAGES = 16
+RESULT_ROWS = 4096
+
+
+def forward(model, images):
+    def run():
+        with torch.no_grad():
+            model(images)
+
+    return run
+
+
+def dataset_epoch(dataset):
+    def run():
+        for ix in range(len(dataset)):
+            to_float(dataset[ix][0])
+
+    return run
+
+
+def write_results(gateway):
+    rng = np.random.default_rng(0)
+    massive_attr = rng.random((RESULT_ROWS, 1000), dtype=np.float32)
+    categories = rng.random((RESULT_ROWS, 50), dtype=np.float32)
+    records = [
+        {
+            "image_name": [f"tasks/bench/images/{i}.jpg"],
+            "category_prediction_index": int(categories[i].argmax()),
+            "category_prediction": "Dress",
+            "mlflow_run_id": "bench",
+        }
+        for i in range(RESULT_ROWS)
+    ]
+
+    def run():
+        with ResultWriter(gateway, "bench", "results/", ["massive_attr", "categories"]) as writer:
+            for start in range(0, RESULT_ROWS, 16):
+                writer.write_batch(
+                    records[start : start + 16],
+                    {
+                        "massive_attr": massive_attr[start : start + 16],
+                        "categories": categories[start : start + 16],
+                    },
+                )
+
+    return run
+
+
+def benchmarks() -> list[Benchmark]:
+    torch.manual_seed(0)
+    torch.set_num_threads(os.cpu_count() or 1)
+    workdir = tempfile.mkdtemp(prefix="bench-inference-")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    gateway = LocalGateway(workdir)
+    set_gateway(gateway)
+
+    model = FashionNetVgg16NoBn().eval()
+    suite = [
+        Benchmark(
+            f"forward_batch_{batch_size}",
+            forward(model, torch.rand(batch_size, 3, 224, 224) * 255),
+            repeat=3,
+        )
+        for batch_size in FORWARD_BATCH_SIZES
+    ]
+
+    features = torch.relu(torch.randn(16, 512, 14, 14))
+    landmarks = torch.rand(16, 2 * N_LANDMARKS) * 224
+    rois = landmark_predictions_to_roipool_boxes(landmarks, bbs=3)
+    gates = torch.rand(16, N_LANDMARKS) < 0.1
+    suite += [
+        Benchmark(
+            "landmark_predictions_to_roipool_boxes",
+            lambda: landmark_predictions_to_roipool_boxes(landmarks, bbs=3),
+            number=200,
+        ),
+        Benchmark(
+            "gated_roi_pooling", lambda: gated_roi_pooling(features, rois, gates), number=50
+        ),
+    ]
+
+    names = upload_jpegs(gateway, "tcc-clothes", "tasks/bench/images/", DATASET_IMAGES, 1080, 1440)
+    suite.append(Benchmark("images_dataset_epoch", dataset_epoch(ImagesDataset(names))))
+    suite.append(Benchmark("result_writer", write_results(gateway)))
+    return suite
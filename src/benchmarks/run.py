@@ -0,0 +1,98 @@
+"""
+Runs benchmark suites and compares them with their stored baseline
+
+    python src/benchmarks/run.py inference imagery api [--output results.json]
+    python src/benchmarks/run.py inference --update-baseline
+
+Each suite imports its service the way the service is deployed, so suites run in their own
+process, with the interpreter holding the dependencies of that service (see --python). The exit
+code is 1 when a benchmark regressed against its baseline.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from benchmarks.harness import compare, load_baseline, run_suite, save_baseline  # noqa: E402
+
+SUITES = ("inference", "imagery", "api")
+DEFAULT_TOLERANCE = float(os.getenv("BENCHMARK_TOLERANCE", 1.3))
+
+
+def run_in_process(suite: str, only: list[str]) -> dict:
+    module = importlib.import_module(f"benchmarks.{suite}")
+    return run_suite(suite, module.benchmarks(), only=only)
+
+
+def run_in_subprocess(suite: str, python: str, only: list[str]) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        command = [python, os.path.abspath(__file__), suite, "--raw", output.name]
+        for name in only:
+            command += ["--only", name]
+        subprocess.run(command, check=True)
+        return json.load(output)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Runs the benchmark suites")
+    parser.add_argument("suites", nargs="*", default=list(SUITES), help=f"among {SUITES}")
+    parser.add_argument("--only", action="append", default=[], help="benchmark to run")
+    parser.add_argument("--output", help="write the results and comparisons into this file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument(
+        "--python",
+        action="append",
+        default=[],
+        metavar="SUITE=INTERPRETER",
+        help="interpreter to run a suite with, e.g. api=.venv-api/bin/python",
+    )
+    parser.add_argument("--raw", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(message)s")
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites {sorted(unknown)}, expected some of {SUITES}")
+
+    if args.raw:
+        with open(args.raw, "w", encoding="utf-8") as raw_file:
+            json.dump(run_in_process(args.suites[0], args.only), raw_file)
+        return 0
+
+    interpreters = dict(option.split("=", 1) for option in args.python)
+    report = {}
+    regressed = False
+    for suite in args.suites:
+        results = run_in_subprocess(suite, interpreters.get(suite, sys.executable), args.only)
+        baseline = load_baseline(suite)
+        if args.update_baseline:
+            print(f"{suite}: baseline written into {save_baseline(results)}")
+        elif baseline is not None:
+            results["comparison"] = compare(results, baseline, args.tolerance)
+            regressed = regressed or bool(results["comparison"]["regressions"])
+        report[suite] = results
+
+        for name, stats in results["benchmarks"].items():
+            ratio = results.get("comparison", {}).get("ratios", {}).get(name)
+            versus = "" if ratio is None else f"  x{ratio:.2f} vs baseline"
+            print(f"{suite}.{name:<40} {stats['median_s'] * 1000:>12.3f} ms{versus}")
+        for name in results.get("comparison", {}).get("regressions", []):
+            print(f"REGRESSION {suite}.{name}: more than x{args.tolerance} the baseline")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+"""Modules shared by the API and the workers.
+
+Each service is deployed from its own directory, so `make common` copies this package next to
+the service code before building or deploying it.
+"""
@@ -0,0 +1,26 @@
+"""Image decoding shared by the workers"""
+from __future__ import annotations
+
+from io import BytesIO
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+
+def decode_image(data: bytes, size: Optional[tuple[int, int]] = None) -> np.ndarray:
+    """
+    Decodes an encoded image into a uint8 array.
+
+    When `size` is given, JPEG images are decoded with DCT scaling at the smallest power of two
+    reduction, down to 1/8, that is still at least `size` on both sides. Pixels that a later resize
+    would throw away are never decoded. Other formats are decoded at full size.
+
+    :param data: encoded image
+    :param size: (width, height) the image is going to be resized to, None for a full decode
+    :return: [height, width] or [height, width, channels] uint8 array
+    """
+    image = Image.open(BytesIO(data))
+    if size is not None:
+        image.draft(None, size)
+    return np.asarray(image)
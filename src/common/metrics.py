@@ -0,0 +1,148 @@
+"""
+Prometheus metrics of the services, and the timing of task stages
+
+Metrics are `prometheus_client` collectors of its default `REGISTRY`, which services serve on
+`/metrics` with `generate_latest`. They live in the memory of the process that records them, so
+every gunicorn or uvicorn worker process exposes its own.
+
+Tasks time their stages with a `TaskTimer`, which feeds the `task_stage_seconds` histogram and
+keeps a per-task summary, logged and stored along with the task status.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional, Sequence
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# from 1ms for per-image stages up to 15min for whole tasks
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900
+)
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Returns the counter `name`, created on first use."""
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    """Returns the histogram `name`, created on first use."""
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def _get_or_create(kind, name, documentation, labelnames, **kwargs):
+    # modules declaring metrics may be imported twice, e.g. as main and src.api.main, while the
+    # default registry rejects a second collector with the same name
+    with _metrics_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = kind(name, documentation, labelnames, **kwargs)
+    if not isinstance(metric, kind):
+        raise ValueError(f"Metric {name} is already registered as a {type(metric).__name__}")
+    return metric
+
+
+STAGE_SECONDS = histogram("task_stage_seconds", "Time spent by tasks in each stage", ["stage"])
+STAGE_ITEMS = counter(
+    "task_stage_items", "Items, e.g. images, processed by tasks in each stage", ["stage"]
+)
+TASK_SECONDS = histogram("task_duration_seconds", "Duration of tasks", ["status"])
+
+
+class TaskTimer:
+    """
+    Times the stages of a task.
+
+    Every timed stage is observed in `task_stage_seconds`, and added up into `stages`, the time
+    the task spent in each stage. Used as a context manager around the whole task, it also records
+    the task duration as the `total` stage and logs the summary.
+
+    :param task_id: task the timer belongs to, for the summary log
+    """
+
+    def __init__(self, task_id: Optional[str] = None):
+        self.task_id = task_id
+        self.stages = {}
+        self.items = {}
+        self._start = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._start
+        with self._lock:
+            self.stages["total"] = duration
+        TASK_SECONDS.labels(status="failed" if exc_type else "success").observe(duration)
+        logger.info("Timings of task %s: %s", self.task_id, self.summary())
+
+    def add(self, stage: str, seconds: float, items: int = 0) -> None:
+        """Records `seconds` spent in `stage`, processing `items` items."""
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+        if items:
+            STAGE_ITEMS.labels(stage=stage).inc(items)
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            if items:
+                self.items[stage] = self.items.get(stage, 0) + items
+
+    @contextmanager
+    def stage(self, stage: str, items: int = 0):
+        """Times the block as `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, items)
+
+    def iterate(self, stage: str, iterable: Iterable):
+        """Yields the items of `iterable`, timing how long each one takes to come as `stage`."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def exiting(self, stage: str, manager):
+        """Wraps a context manager so that its exit, e.g. a final flush, is timed as `stage`."""
+        return _TimedExit(self, stage, manager)
+
+    def summary(self) -> dict:
+        """Returns the seconds spent in each stage, rounded to the millisecond."""
+        with self._lock:
+            return {stage: round(seconds, 3) for stage, seconds in self.stages.items()}
+
+
+class _TimedExit:
+    def __init__(self, timer: TaskTimer, stage: str, manager):
+        self._timer = timer
+        self._stage = stage
+        self._manager = manager
+
+    def __enter__(self):
+        return self._manager.__enter__()
+
+    def __exit__(self, exc_type, exc, traceback):
+        with self._timer.stage(self._stage):
+            return self._manager.__exit__(exc_type, exc, traceback)
@@ -0,0 +1,183 @@
+"""Sharded, columnar format for inference results
+
+A result set lives under a prefix such as `tasks/<task_id>/inferences/`:
+
+    manifest.json                       shards, row counts and columns
+    part-00000.jsonl                    scalar fields, one json record per row
+    part-00000.<vector column>.npy      float32 matrix, one row per record
+
+Shards are written as soon as they fill up, so a writer never holds more than one shard in memory,
+and a reader only downloads the files of the columns it asks for.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Iterable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+FORMAT_NAME = "jsonl+npy"
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+def shard_name(index: int) -> str:
+    return f"part-{index:05d}"
+
+
+class ResultWriter:
+    """
+    Streams result records into shards of `shard_size` rows.
+
+    Shards are uploaded on a background thread while the caller keeps producing batches, and the
+    manifest is written by `close`, which makes the result set visible to readers.
+
+    :param gateway: storage gateway
+    :param bucket_name: destination bucket
+    :param prefix: destination prefix, e.g. `tasks/<task_id>/inferences/`
+    :param vector_columns: names of the float vector columns stored as `.npy` sidecars
+    :param shard_size: rows per shard
+    """
+
+    def __init__(
+        self,
+        gateway,
+        bucket_name: str,
+        prefix: str,
+        vector_columns: Iterable[str],
+        shard_size: int = 1024,
+    ):
+        self._gateway = gateway
+        self._bucket_name = bucket_name
+        self._prefix = prefix.rstrip("/") + "/"
+        self._vector_columns = list(vector_columns)
+        self._shard_size = shard_size
+        self._records = []
+        self._vectors = {column: [] for column in self._vector_columns}
+        self._shards = []
+        self._columns = []
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._uploads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
+
+    def write_batch(self, records: list[dict], vectors: dict) -> None:
+        """
+        Adds a batch of rows.
+
+        :param records: scalar fields of each row
+        :param vectors: a [len(records), n] array for every vector column
+        """
+        for column in self._vector_columns:
+            self._vectors[column].append(np.asarray(vectors[column], dtype=np.float32))
+        self._records.extend(records)
+        if not self._columns and records:
+            self._columns = list(records[0])
+        while len(self._records) >= self._shard_size:
+            self._flush(self._shard_size)
+
+    def close(self) -> dict:
+        """Writes the last shard and the manifest, and returns the manifest."""
+        if self._records:
+            self._flush(len(self._records))
+        for upload in self._uploads:
+            upload.result()
+        self._executor.shutdown(wait=True)
+        manifest = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "rows": sum(shard["rows"] for shard in self._shards),
+            "columns": self._columns,
+            "vector_columns": self._vector_columns,
+            "shards": self._shards,
+        }
+        self._gateway.upload(
+            self._bucket_name,
+            self._prefix + MANIFEST_NAME,
+            json.dumps(manifest),
+            content_type="application/json",
+        )
+        logger.info("Wrote %d rows in %d shards", manifest["rows"], len(self._shards))
+        return manifest
+
+    def _flush(self, rows: int) -> None:
+        name = shard_name(len(self._shards))
+        records, self._records = self._records[:rows], self._records[rows:]
+        files = {f"{name}.jsonl": "\n".join(json.dumps(record) for record in records)}
+        for column in self._vector_columns:
+            matrix = np.concatenate(self._vectors[column])
+            self._vectors[column] = [matrix[rows:]]
+            buffer = BytesIO()
+            np.save(buffer, matrix[:rows])
+            files[f"{name}.{column}.npy"] = buffer.getvalue()
+        self._shards.append({"name": name, "rows": rows})
+        for file_name, contents in files.items():
+            self._uploads.append(
+                self._executor.submit(
+                    self._gateway.upload, self._bucket_name, self._prefix + file_name, contents
+                )
+            )
+
+
+def read_manifest(gateway, bucket_name: str, prefix: str) -> dict:
+    """Reads the manifest of a result set."""
+    prefix = prefix.rstrip("/") + "/"
+    return json.loads(gateway.download(bucket_name, prefix + MANIFEST_NAME))
+
+
+def read_results(
+    gateway, bucket_name: str, prefix: str, columns: Optional[Iterable[str]] = None
+) -> dict:
+    """
+    Loads a result set, column by column.
+
+    Only the files holding the requested columns are downloaded: asking for
+    `["category_prediction"]` never touches the vector sidecars.
+
+    :param gateway: storage gateway
+    :param bucket_name: bucket holding the results
+    :param prefix: prefix the result set was written to
+    :param columns: columns to load, all of them when omitted
+    :return: a list per scalar column and a float32 [rows, n] array per vector column
+    """
+    prefix = prefix.rstrip("/") + "/"
+    manifest = read_manifest(gateway, bucket_name, prefix)
+    if columns is None:
+        columns = manifest["columns"] + manifest["vector_columns"]
+    columns = list(columns)
+    scalar_columns = [column for column in columns if column not in manifest["vector_columns"]]
+    vector_columns = [column for column in columns if column in manifest["vector_columns"]]
+
+    result = {column: [] for column in scalar_columns}
+    vectors = {column: [] for column in vector_columns}
+    for shard in manifest["shards"]:
+        if scalar_columns:
+            lines = gateway.download(bucket_name, f"{prefix}{shard['name']}.jsonl")
+            for line in lines.decode("utf-8").splitlines():
+                record = json.loads(line)
+                for column in scalar_columns:
+                    result[column].append(record.get(column))
+        for column in vector_columns:
+            contents = gateway.download(bucket_name, f"{prefix}{shard['name']}.{column}.npy")
+            vectors[column].append(np.load(BytesIO(contents)))
+
+    for column in vector_columns:
+        result[column] = (
+            np.concatenate(vectors[column])
+            if vectors[column]
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+    return result
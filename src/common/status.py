@@ -0,0 +1,101 @@
+"""Task status store written by the workers and read by the API"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from .storage import get_gateway, is_not_found
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+SUCCESS = "SUCCESS"
+FAILED = "FAILED"
+TERMINAL_STATUSES = (SUCCESS, FAILED)
+
+
+class TaskStatusStore:
+    """
+    Keeps the status of every Cloud Task as a json blob, `<prefix>/<queue>/<task_id>.json`.
+
+    A record holds the task `status`, `started_at` and `finished_at` unix timestamps, the
+    `duration_s` of the last attempt and the `error` of a failed one. Tasks without a record
+    have not started yet.
+
+    :param bucket_name: bucket holding the records
+    :param prefix: prefix of the records in the bucket
+    :param gateway: storage gateway, the process-wide one by default
+    """
+
+    def __init__(self, bucket_name: str, prefix: str = "task-status", gateway=None):
+        self._bucket_name = bucket_name
+        self._prefix = prefix.rstrip("/")
+        self._gateway = gateway
+
+    @property
+    def gateway(self):
+        return self._gateway or get_gateway()
+
+    def path(self, queue: str, task_id: str) -> str:
+        return f"{self._prefix}/{queue}/{task_id}.json"
+
+    def get(self, queue: str, task_id: str) -> Optional[dict]:
+        """Returns the record of a task, or None if it has not started."""
+        try:
+            contents = self.gateway.download(self._bucket_name, self.path(queue, task_id))
+        except Exception as error:  # pylint: disable=broad-except
+            if is_not_found(error):
+                return None
+            raise
+        return json.loads(contents)
+
+    def put(self, queue: str, task_id: str, record: dict) -> None:
+        self.gateway.upload(
+            self._bucket_name,
+            self.path(queue, task_id),
+            json.dumps(record),
+            content_type="application/json",
+        )
+
+    @contextmanager
+    def track(self, queue: Optional[str], task_id: Optional[str], **details):
+        """
+        Records a task as running, then as succeeded or failed depending on how the block exits.
+
+        Does nothing when the task is not known, e.g. when a worker is called outside Cloud Tasks.
+
+        :param queue: queue the task was dispatched to
+        :param task_id: Cloud Task id
+        :param details: extra fields stored in the record
+        :return: the record, whose fields set inside the block are stored with the final status
+        """
+        record = {"task_id": task_id, "queue": queue, "status": RUNNING, **details}
+        if not queue or not task_id:
+            yield record
+            return
+
+        record["started_at"] = time.time()
+        self._safe_put(queue, task_id, record)
+        try:
+            yield record
+        except Exception as error:
+            self._finish(queue, task_id, record, FAILED, repr(error))
+            raise
+        self._finish(queue, task_id, record, SUCCESS)
+
+    def _finish(self, queue, task_id, record, status, error=None):
+        record = dict(record, status=status, finished_at=time.time(), error=error)
+        record["duration_s"] = record["finished_at"] - record["started_at"]
+        self._safe_put(queue, task_id, record)
+
+    def _safe_put(self, queue, task_id, record):
+        # a status that cannot be written must not fail the task itself
+        try:
+            self.put(queue, task_id, record)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not write status of task %s/%s", queue, task_id)
@@ -0,0 +1,190 @@
+"""Storage gateway shared by the workers"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "/tmp/storage")
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", 32))
+
+
+class GCSGateway:
+    """
+    Google Cloud Storage backend.
+
+    Holds a single long-lived client whose HTTP session keeps up to `pool_size` connections
+    open, and caches bucket handles so no call pays for a bucket lookup.
+    """
+
+    def __init__(self, client=None, pool_size: int = STORAGE_POOL_SIZE):
+        if client is None:
+            client = pooled_client(pool_size)
+        self._client = client
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, bucket_name: str):
+        """Returns a cached handle for `bucket_name`, without any round trip."""
+        with self._lock:
+            if bucket_name not in self._buckets:
+                self._buckets[bucket_name] = self._client.bucket(bucket_name)
+            return self._buckets[bucket_name]
+
+    def download(self, bucket_name: str, blob_name: str) -> bytes:
+        """Downloads a blob into memory."""
+        return self.bucket(bucket_name).blob(blob_name).download_as_bytes()
+
+    def upload(
+        self,
+        bucket_name: str,
+        blob_name: str,
+        contents,
+        content_type: Optional[str] = None,
+    ) -> None:
+        """Uploads `contents` (bytes or str) into a blob."""
+        blob = self.bucket(bucket_name).blob(blob_name)
+        blob.upload_from_string(contents, content_type=content_type)
+
+    def list(
+        self, bucket_name: str, prefix: str, delimiter: Optional[str] = None
+    ) -> list[str]:
+        """Lists the names of the blobs in the bucket that begin with the prefix."""
+        blobs = self._client.list_blobs(bucket_name, prefix=prefix, delimiter=delimiter)
+        return [blob.name for blob in blobs]
+
+    def copy(
+        self,
+        bucket_name: str,
+        blob_name: str,
+        destination_blob_name: str,
+        destination_bucket_name: Optional[str] = None,
+    ) -> None:
+        """Copies a blob server side, in a single request."""
+        source_bucket = self.bucket(bucket_name)
+        destination_bucket = self.bucket(destination_bucket_name or bucket_name)
+        source_bucket.copy_blob(
+            source_bucket.blob(blob_name), destination_bucket, destination_blob_name
+        )
+
+
+class LocalGateway:
+    """
+    Local filesystem backend, with blobs stored under `<root>/<bucket_name>/<blob_name>`.
+
+    Lets the workers run offline, e.g. to measure their throughput without GCS in the way.
+    """
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT):
+        self._root = Path(root)
+
+    def path(self, bucket_name: str, blob_name: str) -> Path:
+        """Returns the local path backing a blob."""
+        return self._root / bucket_name / blob_name
+
+    def download(self, bucket_name: str, blob_name: str) -> bytes:
+        """Downloads a blob into memory."""
+        return self.path(bucket_name, blob_name).read_bytes()
+
+    def upload(
+        self,
+        bucket_name: str,
+        blob_name: str,
+        contents,
+        content_type: Optional[str] = None,
+    ) -> None:
+        """Uploads `contents` (bytes or str) into a blob."""
+        path = self.path(bucket_name, blob_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(contents, str):
+            contents = contents.encode("utf-8")
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(contents)
+        os.replace(tmp_path, path)
+
+    def list(
+        self, bucket_name: str, prefix: str, delimiter: Optional[str] = None
+    ) -> list[str]:
+        """Lists the names of the blobs in the bucket that begin with the prefix."""
+        bucket_root = self._root / bucket_name
+        if not bucket_root.exists():
+            return []
+        names = sorted(
+            path.relative_to(bucket_root).as_posix()
+            for path in bucket_root.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+        names = [name for name in names if name.startswith(prefix)]
+        if delimiter:
+            names = [name for name in names if delimiter not in name[len(prefix) :]]
+        return names
+
+    def copy(
+        self,
+        bucket_name: str,
+        blob_name: str,
+        destination_blob_name: str,
+        destination_bucket_name: Optional[str] = None,
+    ) -> None:
+        """Copies a blob."""
+        destination = self.path(destination_bucket_name or bucket_name, destination_blob_name)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.path(bucket_name, blob_name), destination)
+
+
+def is_not_found(error: Exception) -> bool:
+    """Returns whether a gateway error means the blob does not exist, whatever the backend."""
+    return isinstance(error, FileNotFoundError) or getattr(error, "code", None) == 404
+
+
+def pooled_client(pool_size: int):
+    """Creates a storage client whose HTTP session pools `pool_size` connections."""
+    # pylint: disable=import-outside-toplevel
+    from google.cloud import storage
+    from requests.adapters import HTTPAdapter
+
+    client = storage.Client()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    client._http.mount("https://", adapter)  # pylint: disable=protected-access
+    return client
+
+
+_gateway = None
+_gateway_pid = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    Returns the process-wide storage gateway, creating it on first use.
+
+    The backend is picked with `STORAGE_BACKEND` (`gcs` or `local`). Forked processes, such as
+    DataLoader workers, get their own gateway instead of sharing the parent's connections.
+    """
+    global _gateway, _gateway_pid  # pylint: disable=global-statement
+    with _gateway_lock:
+        if _gateway is None:
+            if STORAGE_BACKEND == "local":
+                _gateway = LocalGateway(STORAGE_LOCAL_ROOT)
+            else:
+                _gateway = GCSGateway()
+            logger.info("Using %s storage backend", STORAGE_BACKEND)
+        elif _gateway_pid != os.getpid() and isinstance(_gateway, GCSGateway):
+            _gateway = GCSGateway()
+        _gateway_pid = os.getpid()
+        return _gateway
+
+
+def set_gateway(gateway) -> None:
+    """Replaces the process-wide storage gateway, e.g. with a `LocalGateway`."""
+    global _gateway, _gateway_pid  # pylint: disable=global-statement
+    with _gateway_lock:
+        _gateway = gateway
+        _gateway_pid = os.getpid()
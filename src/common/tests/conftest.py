@@ -0,0 +1,15 @@
+"""Create pytest fixtures"""
+import os
+import sys
+
+import pytest
+
+# Services import the shared modules as the top level `common` package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from common.storage import LocalGateway  # noqa: E402 pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    return LocalGateway(str(tmp_path))
@@ -0,0 +1,33 @@
+"""Unit tests for the shared image decoder"""
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from common.images import decode_image
+
+
+def encode(image, image_format):
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def test_jpeg_is_decoded_near_the_target_size():
+    """JPEGs should be scaled down by the decoder, never below the target size"""
+    gradient = np.linspace(0, 255, 1200 * 900, dtype=np.float32).reshape(1200, 900)
+    image = np.stack([gradient, gradient[::-1], np.full_like(gradient, 128)], axis=-1)
+    data = encode(image.astype(np.uint8), "JPEG")
+
+    full = decode_image(data)
+    reduced = decode_image(data, size=(224, 224))
+
+    assert full.shape == (1200, 900, 3)
+    assert reduced.dtype == np.uint8
+    assert reduced.shape == (300, 225, 3)
+
+
+def test_other_formats_are_decoded_at_full_size():
+    """Formats without DCT scaling should decode exactly as before"""
+    image = np.random.default_rng(0).integers(0, 255, size=(400, 300, 3), dtype=np.uint8)
+    np.testing.assert_array_equal(decode_image(encode(image, "PNG"), size=(224, 224)), image)
@@ -0,0 +1,45 @@
+"""Unit tests for the metric helpers and the task timer"""
+from contextlib import nullcontext
+
+import pytest
+from prometheus_client import REGISTRY, generate_latest
+
+from common.metrics import TaskTimer, counter, histogram
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_declaring_a_metric_again_returns_the_existing_one():
+    """Modules declaring metrics may be imported twice, e.g. as main and src.api.main"""
+    tasks = counter("test_tasks", "Tasks", ["queue"])
+
+    assert counter("test_tasks", "Tasks", ["queue"]) is tasks
+    with pytest.raises(ValueError):
+        histogram("test_tasks", "Tasks", ["queue"])
+
+    tasks.labels(queue="imagery").inc(2)
+    assert 'test_tasks_total{queue="imagery"} 2.0' in generate_latest(REGISTRY).decode()
+
+
+def test_task_timer_sums_stages_and_records_the_task():
+    """Stages add up per task, and the whole task is recorded once the timer exits"""
+    forward_count = sample("task_stage_seconds_count", stage="forward")
+    forward_items = sample("task_stage_items_total", stage="forward")
+    failed_count = sample("task_duration_seconds_count", status="failed")
+
+    with pytest.raises(RuntimeError):
+        with TaskTimer("123") as timer:
+            for _ in timer.iterate("data_wait", range(3)):
+                with timer.stage("forward", items=16):
+                    pass
+            with timer.exiting("result_upload", nullcontext()):
+                raise RuntimeError("upload failed")
+
+    assert set(timer.stages) == {"data_wait", "forward", "result_upload", "total"}
+    assert timer.items == {"forward": 48}
+    assert timer.stages["total"] >= timer.stages["forward"]
+    assert sample("task_stage_seconds_count", stage="forward") == forward_count + 3
+    assert sample("task_stage_items_total", stage="forward") == forward_items + 48
+    assert sample("task_duration_seconds_count", status="failed") == failed_count + 1
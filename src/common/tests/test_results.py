@@ -0,0 +1,42 @@
+"""Unit tests for the sharded result format"""
+import numpy as np
+
+from common.results import ResultWriter, read_manifest, read_results
+
+
+def write_results(gateway, batches, shard_size):
+    with ResultWriter(
+        gateway, "bucket", "tasks/t/inferences", ["categories"], shard_size=shard_size
+    ) as writer:
+        for start, rows in batches:
+            records = [{"image_name": f"{i}.jpg", "index": i} for i in range(start, start + rows)]
+            vectors = np.arange(start, start + rows, dtype=np.float32)[:, None].repeat(3, axis=1)
+            writer.write_batch(records, {"categories": vectors})
+
+
+def test_results_round_trip_across_shards(gateway):
+    """Rows should come back in order whatever the batch and shard boundaries"""
+    write_results(gateway, [(0, 3), (3, 4), (7, 3)], shard_size=4)
+
+    manifest = read_manifest(gateway, "bucket", "tasks/t/inferences/")
+    results = read_results(gateway, "bucket", "tasks/t/inferences/")
+
+    assert [shard["rows"] for shard in manifest["shards"]] == [4, 4, 2]
+    assert results["index"] == list(range(10))
+    assert results["categories"].dtype == np.float32
+    assert results["categories"][:, 0].tolist() == list(range(10))
+
+
+def test_read_results_only_downloads_requested_columns(gateway, monkeypatch):
+    """Scalar columns should be readable without touching the vector sidecars"""
+    write_results(gateway, [(0, 5)], shard_size=2)
+    downloaded = []
+    download = gateway.download
+    monkeypatch.setattr(
+        gateway, "download", lambda bucket, name: downloaded.append(name) or download(bucket, name)
+    )
+
+    results = read_results(gateway, "bucket", "tasks/t/inferences/", columns=["image_name"])
+
+    assert results == {"image_name": [f"{i}.jpg" for i in range(5)]}
+    assert not [name for name in downloaded if name.endswith(".npy")]
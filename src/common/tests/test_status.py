@@ -0,0 +1,33 @@
+"""Unit tests for the task status store"""
+import pytest
+
+from common.status import FAILED, RUNNING, SUCCESS, TaskStatusStore
+
+
+def test_track_records_running_then_success(gateway):
+    """A task should be running inside the block and succeeded after it"""
+    store = TaskStatusStore("bucket", gateway=gateway)
+
+    assert store.get("imagery", "1") is None
+    with store.track("imagery", "1", run_id="abc") as details:
+        assert store.get("imagery", "1")["status"] == RUNNING
+        details["rows"] = 10
+
+    record = store.get("imagery", "1")
+    assert record["status"] == SUCCESS
+    assert record["run_id"] == "abc"
+    assert record["rows"] == 10
+    assert record["finished_at"] >= record["started_at"]
+
+
+def test_track_records_failures(gateway):
+    """An exception should mark the task failed and still propagate"""
+    store = TaskStatusStore("bucket", gateway=gateway)
+
+    with pytest.raises(ValueError):
+        with store.track("inference", "2"):
+            raise ValueError("no images")
+
+    record = store.get("inference", "2")
+    assert record["status"] == FAILED
+    assert "no images" in record["error"]
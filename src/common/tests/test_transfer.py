@@ -0,0 +1,42 @@
+"""Unit tests for bulk storage operations"""
+from common.transfer import bulk_copy
+
+
+class FlakyGateway:
+    """Fails the first copy of every blob with a transient error"""
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+        self._seen = set()
+
+    def copy(self, bucket_name, blob_name, destination_blob_name):
+        if blob_name not in self._seen:
+            self._seen.add(blob_name)
+            raise ConnectionError("connection reset")
+        self._gateway.copy(bucket_name, blob_name, destination_blob_name)
+
+
+def test_bulk_copy_reports_missing_blobs(gateway):
+    """Missing sources should be reported without stopping the other copies"""
+    for image_id in range(5):
+        gateway.upload("bucket", f"images/{image_id}.jpg", b"jpeg")
+    copies = [(f"images/{i}.jpg", f"tasks/t/images/{i}.jpg") for i in range(6)]
+
+    summary = bulk_copy(gateway, "bucket", copies, concurrency=4)
+
+    assert sorted(summary.copied) == [f"tasks/t/images/{i}.jpg" for i in range(5)]
+    assert list(summary.failed) == ["tasks/t/images/5.jpg"]
+    assert gateway.download("bucket", "tasks/t/images/3.jpg") == b"jpeg"
+
+
+def test_bulk_copy_retries_transient_errors(gateway, monkeypatch):
+    """Transient errors should be retried per blob"""
+    monkeypatch.setattr("common.transfer.time.sleep", lambda _: None)
+    gateway.upload("bucket", "images/1.jpg", b"jpeg")
+
+    summary = bulk_copy(
+        FlakyGateway(gateway), "bucket", [("images/1.jpg", "tasks/t/images/1.jpg")]
+    )
+
+    assert summary.copied == ["tasks/t/images/1.jpg"]
+    assert not summary.failed
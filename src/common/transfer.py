@@ -0,0 +1,96 @@
+"""Concurrent bulk operations on top of the storage gateway"""
+from __future__ import annotations
+
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PERMANENT_ERROR_CODES = (400, 401, 403, 404)
+
+
+class CopySummary:
+    """Outcome of a bulk copy: copied destinations and the error of every failed copy."""
+
+    def __init__(self):
+        self.copied: list[str] = []
+        self.failed: dict[str, str] = {}
+
+    def __repr__(self):
+        return f"CopySummary(copied={len(self.copied)}, failed={len(self.failed)})"
+
+
+def is_permanent(error: Exception) -> bool:
+    """Tells whether retrying after `error` is pointless, e.g. a missing source blob."""
+    if isinstance(error, FileNotFoundError):
+        return True
+    return getattr(error, "code", None) in PERMANENT_ERROR_CODES
+
+
+def with_retries(func, retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0):
+    """
+    Calls `func` until it succeeds, retrying transient errors with jittered exponential backoff.
+
+    :param func: callable without arguments
+    :param retries: retries after the first attempt
+    :param backoff: delay before the first retry, in seconds
+    :param max_backoff: upper bound of any delay, in seconds
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as error:  # pylint: disable=broad-except
+            if attempt >= retries or is_permanent(error):
+                raise
+            delay = min(max_backoff, backoff * 2**attempt) * random.uniform(0.5, 1.5)
+            logger.warning("Retrying in %.2fs after: %s", delay, error)
+            time.sleep(delay)
+            attempt += 1
+
+
+def bulk_copy(
+    gateway,
+    bucket_name: str,
+    copies: Iterable[tuple[str, str]],
+    concurrency: int = 32,
+    retries: int = 3,
+) -> CopySummary:
+    """
+    Copies blobs within a bucket using a bounded pool of threads.
+
+    Every copy is retried on its own, so a task with N blobs takes roughly N / concurrency
+    round trips and a failing blob never stops the others.
+
+    :param gateway: storage gateway
+    :param bucket_name: bucket holding both the sources and the destinations
+    :param copies: (blob_name, destination_blob_name) pairs
+    :param concurrency: maximum number of copies in flight
+    :param retries: retries per blob on transient errors
+    :return: summary of the copy
+    """
+    summary = CopySummary()
+
+    def copy(blob_name, destination_blob_name):
+        with_retries(
+            lambda: gateway.copy(bucket_name, blob_name, destination_blob_name),
+            retries=retries,
+        )
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(copy, blob_name, destination_blob_name): destination_blob_name
+            for blob_name, destination_blob_name in copies
+        }
+        for future, destination_blob_name in futures.items():
+            error = future.exception()
+            if error is None:
+                summary.copied.append(destination_blob_name)
+            else:
+                summary.failed[destination_blob_name] = repr(error)
+
+    return summary
@@ -1,14 +1,22 @@
+# pylint: disable=wrong-import-position
 """Runs CD4ML Pipeline Task to compare classifier models"""
-import json
+from __future__ import annotations
+
 import logging
 import os
 import sys
+import threading
 import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 
 import requests
-from google.cloud import storage
+from requests.adapters import HTTPAdapter
 from mlflow import MlflowClient
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.results import read_manifest, read_results  # noqa: E402
+from common.storage import get_gateway  # noqa: E402
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -19,42 +27,62 @@ BUCKET_NAME = os.getenv("BUCKET_NAME")
 LIMIT = 10
 YEAR = 2012
 
+IMAGERY_TIMEOUT = float(os.getenv("IMAGERY_TIMEOUT", 1800))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", 1800))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 60))
+LONG_POLL_TIMEOUT = 30
+
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+cancelled = threading.Event()
 
-def download_blob_into_memory(blob_name):
-    """Downloads a blob into memory."""
-    storage_client = storage.Client()
 
-    bucket = storage_client.bucket(BUCKET_NAME)
+class TaskCancelled(Exception):
+    """
+    Raised by a step that stopped waiting because another step failed.
 
-    blob = bucket.blob(blob_name)
-    contents = blob.download_as_bytes()
+    Only the waiting stops: the API cannot cancel a task a worker already picked up, so the task
+    keeps running to completion. Its results go to its own prefix, which nothing reads anymore.
+    """
 
-    return contents
 
+def perform_task(params, endpoint, timeout: float) -> dict:
+    """
+    Sends a task to the API and waits for it to finish.
 
-def perform_task(params, endpoint):
-    api_response = requests.post(f"{API_ENDPOINT}/{endpoint}", json=params).json()
+    :param params: payload of the task
+    :param endpoint: API endpoint receiving the payload
+    :param timeout: maximum time to wait for the task, in seconds
+    :return: status record of the task, written by its worker (see `common.status`)
+    :raises TaskCancelled: when another step failed meanwhile, the task itself keeps running
+    """
+    api_response = session.post(
+        f"{API_ENDPOINT}/{endpoint}", json=params, timeout=REQUEST_TIMEOUT
+    ).json()
     task_id = api_response["task_id"]
     queue = api_response["queue"]
-    print(f"task_id: {task_id}")
-    print(f"queue: {queue}")
+    logger.info("task_id: %s queue: %s", task_id, queue)
 
+    deadline = time.monotonic() + timeout
     status = "PENDING"
-    print("Processing...")
-    while status == "PENDING":
-        time.sleep(3)
-        response = requests.get(
-            f"{API_ENDPOINT}/task/{task_id}", params={"queue": f"{queue}"}
+    while status not in ("SUCCESS", "FAILED"):
+        if cancelled.is_set():
+            raise TaskCancelled(f"Stopped waiting for task {task_id} on {queue}")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Task {task_id} on {queue} did not finish in {timeout}s")
+        response = session.get(
+            f"{API_ENDPOINT}/task/{task_id}/wait",
+            params={"queue": queue, "timeout": min(LONG_POLL_TIMEOUT, remaining)},
+            timeout=REQUEST_TIMEOUT + LONG_POLL_TIMEOUT,
         ).json()
         status = response["status"]
-        print(status)
+        logger.info("Task %s on %s: %s", task_id, queue, status)
 
     if status != "SUCCESS":
         raise Exception(response)
-    else:
-        print("Task complete!")
 
-    return task_id
+    return response
 
 
 def run_imagery(queue: str):
@@ -72,29 +100,43 @@ def run_imagery(queue: str):
             }
         },
     }
-    run_id = perform_task(payload, "filter")
+    run_id = perform_task(payload, "filter", timeout=IMAGERY_TIMEOUT)["task_id"]
 
     return run_id
 
 
 def run_inference(run_id: str, queue: str):
-    perform_task({"task_id": run_id, "queue": queue}, "predict")
-    bucket_file = f"tasks/{run_id}/inferences.json"
-    content = download_blob_into_memory(bucket_file)
-    predictions = json.loads(content)
-    logger.info(f"Number of predictions: {len(predictions)}")
-    logger.info(
-        f'Prediction output per image: massive_attr-{len(predictions[0]["massive_attr"])}, '
-        f'categories-{len(predictions[0]["categories"])}'
+    """
+    Predicts the images of an imagery run and returns the AUC of the model.
+
+    Inferences of different models on the same run write to different prefixes and MLflow runs,
+    both read from the status record of this inference task.
+
+    :param run_id: imagery run to predict
+    :param queue: inference queue, serving the model to evaluate
+    :return: AUC logged by the inference
+    """
+    record = perform_task({"task_id": run_id, "queue": queue}, "predict", timeout=INFERENCE_TIMEOUT)
+    prefix = record["results_prefix"]
+    mlflow_run_id = record["mlflow_run_id"]
+    manifest = read_manifest(get_gateway(), BUCKET_NAME, prefix)
+    predictions = read_results(
+        get_gateway(),
+        BUCKET_NAME,
+        prefix,
+        columns=["image_name", "category_prediction_index"],
     )
+    logger.info(f"Number of predictions: {manifest['rows']}")
+    logger.info(f'Prediction output per image: {", ".join(manifest["vector_columns"])}')
 
-    for idx, predict in enumerate(predictions, 1):
+    for idx, (image_name, category_prediction_index) in enumerate(
+        zip(predictions["image_name"], predictions["category_prediction_index"]), 1
+    ):
         logger.info(
-            f'Image number {idx} ----- mlflow_run_id: {predict["mlflow_run_id"]} '
-            f'image_id: {predict["image_name"][0].rsplit("/", 1)[1]} '
-            f'category_prediction: {predict["category_prediction_index"]}'
+            f"Image number {idx} ----- mlflow_run_id: {mlflow_run_id} "
+            f'image_id: {image_name[0].rsplit("/", 1)[1]} '
+            f"category_prediction: {category_prediction_index}"
         )
-        mlflow_run_id = predict["mlflow_run_id"]
 
     client = MlflowClient(tracking_uri=f'http://{os.getenv("MLFLOW_HOST")}:5000')
     history = client.get_metric_history(mlflow_run_id, "AUC")
@@ -102,19 +144,47 @@ def run_inference(run_id: str, queue: str):
     return history[0].value
 
 
+def run_branches(branch_name: str) -> tuple[float, float]:
+    """
+    Runs the prod and candidate steps concurrently and returns their AUCs.
+
+    Both imagery tasks start right away. Both inference tasks run on the prod imagery run, so
+    the models are compared on the same images, and start as soon as it is done. As soon as a
+    step fails, the others stop waiting and the error is raised, see `TaskCancelled`.
+
+    :param branch_name: branch whose queues serve the candidate model
+    :return: AUC of the prod model, AUC of the candidate model
+    """
+    cancelled.clear()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        imagery_prod = executor.submit(run_imagery, queue="imagery")
+        imagery_candidate = executor.submit(run_imagery, queue=f"imagery-{branch_name}")
+
+        def inference(queue):
+            return run_inference(run_id=imagery_prod.result(), queue=queue)
+
+        inference_prod = executor.submit(inference, "inference")
+        inference_candidate = executor.submit(inference, f"inference-{branch_name}")
+
+        steps = [imagery_prod, imagery_candidate, inference_prod, inference_candidate]
+        done, _ = wait(steps, return_when=FIRST_EXCEPTION)
+        failures = [step for step in done if step.exception() is not None]
+        if failures:
+            cancelled.set()
+            raise failures[0].exception()
+
+    return inference_prod.result(), inference_candidate.result()
+
+
 if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(threadName)s %(message)s")
     branch_name = sys.argv[1]
     auc_threshold = sys.argv[2]
     logger.info("Branch Name: %s", branch_name)
     logger.info("AUC threshold: %s", auc_threshold)
 
-    logger.info("Running inference for current model")
-    run_id_prod = run_imagery(queue="imagery")
-    auc_prod = run_inference(run_id=run_id_prod, queue="inference")
-
-    logger.info("Running inference for candidate model")
-    run_id_candidate = run_imagery(queue=f"imagery-{branch_name}")
-    auc_candidate = run_inference(run_id=run_id_prod, queue=f"inference-{branch_name}")
+    logger.info("Running inference for current and candidate models")
+    auc_prod, auc_candidate = run_branches(branch_name)
 
     logger.info("AUC Prod: %s", auc_prod)
     logger.info("AUC Candidate branch %s: %s", branch_name, auc_candidate)
@@ -0,0 +1,19 @@
+# pylint: disable=wrong-import-position
+"""Create pytest fixtures"""
+import os
+import sys
+
+import pytest
+
+# The pipeline is run as `python src/ml_pipeline/main.py`, it imports `common` from src/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from common.storage import LocalGateway, set_gateway  # noqa: E402
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    gateway = LocalGateway(str(tmp_path))
+    set_gateway(gateway)
+    yield gateway
+    set_gateway(None)
@@ -0,0 +1,75 @@
+"""Unit tests for the CD4ML pipeline runner"""
+import itertools
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from common.results import ResultWriter
+from ml_pipeline import main as pipeline
+
+
+class FakeApi:
+    """Runs every task right away, the way the workers would, and answers its status record."""
+
+    def __init__(self, gateway, aucs):
+        self._gateway = gateway
+        self._aucs = aucs
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.records = {}
+        self.predicted_runs = []
+
+    def post(self, url, json, timeout):  # pylint: disable=redefined-outer-name,unused-argument
+        with self._lock:
+            task_id = f"task-{next(self._ids)}"
+        queue = json["queue"]
+        record = {"task_id": task_id, "queue": queue, "status": "SUCCESS"}
+        if url.endswith("/predict"):
+            self.predicted_runs.append(json["task_id"])
+            record["results_prefix"] = f"tasks/{json['task_id']}/inferences/{task_id}/"
+            record["mlflow_run_id"] = f"run-of-{queue}"
+            image_name = f"tasks/{json['task_id']}/1.jpg"
+            with ResultWriter(
+                self._gateway, pipeline.BUCKET_NAME, record["results_prefix"], ["categories"]
+            ) as writer:
+                writer.write_batch(
+                    [{"image_name": [image_name], "category_prediction_index": 0}],
+                    {"categories": np.zeros((1, 50), dtype=np.float32)},
+                )
+        self.records[task_id] = record
+        return SimpleNamespace(json=lambda: {"task_id": task_id, "queue": queue})
+
+    def get(self, url, params, timeout):  # pylint: disable=unused-argument
+        task_id = url.split("/task/")[1].split("/")[0]
+        return SimpleNamespace(json=lambda: self.records[task_id])
+
+    def mlflow_client(self, tracking_uri):  # pylint: disable=unused-argument
+        def get_metric_history(run_id, key):
+            assert key == "AUC"
+            return [SimpleNamespace(value=self._aucs[run_id])]
+
+        return SimpleNamespace(get_metric_history=get_metric_history)
+
+
+@pytest.fixture
+def api(gateway, monkeypatch):
+    fake = FakeApi(gateway, {"run-of-inference": 0.7, "run-of-inference-branch": 0.8})
+    monkeypatch.setattr(pipeline, "BUCKET_NAME", "bucket")
+    monkeypatch.setattr(pipeline, "session", fake)
+    monkeypatch.setattr(pipeline, "MlflowClient", fake.mlflow_client)
+    return fake
+
+
+def test_branches_read_their_own_inference(api):
+    """Both models predict the prod imagery run, each AUC comes from its own MLflow run"""
+    auc_prod, auc_candidate = pipeline.run_branches("branch")
+
+    assert (auc_prod, auc_candidate) == (0.7, 0.8)
+    prod_imagery = next(
+        task_id for task_id, record in api.records.items() if record["queue"] == "imagery"
+    )
+    assert api.predicted_runs == [prod_imagery, prod_imagery]
+    prefixes = {record.get("results_prefix") for record in api.records.values()} - {None}
+    assert len(prefixes) == 2
@@ -0,0 +1,245 @@
+"""Streaming augmentation pipeline for the imagery worker"""
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import threading
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable
+
+import albumentations as A
+import cv2
+import numpy as np
+
+from common.images import decode_image
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+AUGMENTATION_PROCESSES = int(os.getenv("AUGMENTATION_PROCESSES", os.cpu_count() or 1))
+AUGMENTATION_IO_WORKERS = int(os.getenv("AUGMENTATION_IO_WORKERS", 16))
+AUGMENTATION_QUEUE_SIZE = int(os.getenv("AUGMENTATION_QUEUE_SIZE", 64))
+# longest time a single image may take to augment, in seconds
+AUGMENTATION_TIMEOUT = float(os.getenv("AUGMENTATION_TIMEOUT", 120))
+AUGMENTATION_SEED = 42
+
+_STOP = object()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def build_transform(aug_conf: dict) -> A.Compose:
+    """
+    Builds the albumentations transform described by an augmentation config.
+
+    :param aug_conf: augmentation config coming from input
+    """
+    min_height = aug_conf["albumentation"]["cropping"]["height"]["min"]
+    max_height = aug_conf["albumentation"]["cropping"]["height"]["max"]
+    width_resized = aug_conf["albumentation"]["resize"]["width"]
+    height_resized = aug_conf["albumentation"]["resize"]["height"]
+    return A.Compose(
+        [
+            A.RandomSizedCrop(
+                min_max_height=(min_height, max_height),
+                height=height_resized,
+                width=width_resized,
+            )
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def cached_transform(aug_conf_json: str) -> A.Compose:
+    """Builds a transform once per process and config."""
+    return build_transform(json.loads(aug_conf_json))
+
+
+def image_seed(image_id) -> int:
+    """Returns the seed an image is augmented with, stable across runs and processes."""
+    return zlib.crc32(f"{AUGMENTATION_SEED}:{image_id}".encode("utf-8"))
+
+
+def augment(original_img: bytes, aug_conf_json: str, seed: int) -> bytes:
+    """
+    Decodes, augments and re-encodes a single image.
+
+    :param original_img: encoded image
+    :param aug_conf_json: augmentation config, serialized so it can key the transform cache
+    :param seed: seed for the random parameters of the transform
+    :return: augmented image encoded as jpeg
+    """
+    transform = cached_transform(aug_conf_json)
+    image = decode_image(original_img)
+    random.seed(seed)
+    np.random.seed(seed)
+    _, augmented_image = cv2.imencode(".jpg", transform(image=image)["image"])
+    return augmented_image.tobytes()
+
+
+def process_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    Returns the worker-wide pool augmentations run in, kept across tasks.
+
+    Processes are spawned rather than forked, since the worker is multi-threaded.
+    """
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def reset_process_pool(broken: ProcessPoolExecutor) -> None:
+    """
+    Drops a broken worker-wide pool, e.g. after one of its processes died, so the next task gets
+    a new one.
+
+    The pool is only dropped while it is still the worker-wide one, a concurrent task may already
+    have replaced it. It is not shut down either, the tasks still holding it see their images
+    fail, and it is cleaned up once they let it go.
+
+    :param broken: pool that broke
+    """
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+
+
+def run_pipeline(
+    image_ids: Iterable,
+    aug_conf: dict,
+    fetch: Callable[[object], bytes],
+    store: Callable[[object, bytes], None],
+    processes: int = AUGMENTATION_PROCESSES,
+    io_workers: int = AUGMENTATION_IO_WORKERS,
+    queue_size: int = AUGMENTATION_QUEUE_SIZE,
+    timeout: float = AUGMENTATION_TIMEOUT,
+) -> dict:
+    """
+    Augments images through fetch -> augment -> store stages connected by bounded queues.
+
+    Fetching and storing run on `io_workers` threads each, augmentation (decode, transform,
+    encode) runs on `processes` processes, or inline when `processes` is 0. A failing image,
+    including one that cannot be sent to the pool or takes longer than `timeout`, is reported and
+    skipped without stopping the others.
+
+    :param image_ids: ids of the images to augment
+    :param aug_conf: augmentation config coming from input
+    :param fetch: downloads the original image of an id
+    :param store: uploads the augmented image of an id
+    :param processes: size of the augmentation process pool
+    :param io_workers: threads per I/O stage
+    :param queue_size: maximum number of images waiting between two stages
+    :param timeout: longest time to wait for the augmentation of an image, in seconds
+    :return: error of every image that failed, by image id
+    """
+    aug_conf_json = json.dumps(aug_conf, sort_keys=True)
+    cached_transform(aug_conf_json)  # fail fast on an invalid config
+    pool = process_pool(processes) if processes > 0 else None
+
+    pending = queue.Queue()
+    fetched = queue.Queue(maxsize=queue_size)
+    augmented = queue.Queue(maxsize=queue_size)
+    failed = {}
+    failed_lock = threading.Lock()
+    broken = threading.Event()
+
+    def fail(image_id, error):
+        logger.error("Augmentation failed for %s: %s", image_id, error)
+        with failed_lock:
+            failed[image_id] = repr(error)
+
+    def fetcher():
+        while True:
+            image_id = pending.get()
+            if image_id is _STOP:
+                return
+            try:
+                fetched.put((image_id, fetch(image_id)))
+            except Exception as error:  # pylint: disable=broad-except
+                fail(image_id, error)
+
+    def submit(image_id, original_img) -> Future:
+        args = (original_img, aug_conf_json, image_seed(image_id))
+        if pool is not None:
+            try:
+                return pool.submit(augment, *args)
+            except Exception as error:  # pylint: disable=broad-except
+                # a broken pool, or one shut down under us, fails the image, not the pipeline
+                if isinstance(error, BrokenProcessPool):
+                    broken.set()
+                future = Future()
+                future.set_exception(error)
+                return future
+        future = Future()
+        try:
+            future.set_result(augment(*args))
+        except Exception as error:  # pylint: disable=broad-except
+            future.set_exception(error)
+        return future
+
+    def dispatcher():
+        try:
+            while True:
+                item = fetched.get()
+                if item is _STOP:
+                    break
+                augmented.put((item[0], submit(*item)))
+        finally:
+            # storers must stop even if dispatching failed, or the request would hang
+            for _ in range(io_workers):
+                augmented.put(_STOP)
+
+    def storer():
+        while True:
+            item = augmented.get()
+            if item is _STOP:
+                return
+            image_id, future = item
+            try:
+                store(image_id, future.result(timeout=timeout))
+            except FutureTimeoutError:
+                future.cancel()
+                fail(image_id, FutureTimeoutError(f"Not augmented within {timeout}s"))
+            except BrokenProcessPool as error:
+                broken.set()
+                fail(image_id, error)
+            except Exception as error:  # pylint: disable=broad-except
+                fail(image_id, error)
+
+    fetchers = [threading.Thread(target=fetcher, daemon=True) for _ in range(io_workers)]
+    storers = [threading.Thread(target=storer, daemon=True) for _ in range(io_workers)]
+    dispatch = threading.Thread(target=dispatcher, daemon=True)
+    for thread in fetchers + storers + [dispatch]:
+        thread.start()
+
+    count = 0
+    for image_id in image_ids:
+        pending.put(image_id)
+        count += 1
+    for _ in fetchers:
+        pending.put(_STOP)
+
+    for thread in fetchers:
+        thread.join()
+    fetched.put(_STOP)
+    dispatch.join()
+    for thread in storers:
+        thread.join()
+    if broken.is_set():
+        reset_process_pool(pool)
+
+    logger.info("Augmented %d of %d images", count - len(failed), count)
+    return failed
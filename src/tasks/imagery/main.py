@@ -5,47 +5,31 @@ from __future__ import annotations
 import json
 import logging
 import os
-import random
-from io import BytesIO
-
-import albumentations as A
-import cv2
-import numpy as np
-from PIL import Image
-from flask import Flask, request, jsonify
+from typing import Optional
+
+from flask import Flask, Response, request, jsonify
 from google.cloud import bigquery
-from google.cloud import storage
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+from augmentation import run_pipeline
+from product_index import load_product_index
+from products import normalize_filter, query_products
+from common.metrics import TaskTimer
+from common.status import TaskStatusStore
+from common.storage import get_gateway
+from common.transfer import bulk_copy
 
 BUCKET_NAME = os.getenv("BUCKET_NAME")
+COPY_CONCURRENCY = int(os.getenv("COPY_CONCURRENCY", 32))
+COPY_RETRIES = int(os.getenv("COPY_RETRIES", 3))
 app = Flask(__name__)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-client = bigquery.Client()
-
-
-def copy_blob(blob_name, destination_blob_name):
-    """Copies a blob from one bucket to another with a new name.
-
-    :param blob_name: blob name to be copied to another folder
-    :param destination_blob_name: name of the destination blob
-    """
-    storage_client = storage.Client()
-
-    source_bucket = storage_client.get_bucket(BUCKET_NAME)
-    destination_bucket = storage_client.get_bucket(BUCKET_NAME)
-    source_blob = source_bucket.get_blob(blob_name)
-    blob_copy = source_bucket.copy_blob(
-        source_blob, destination_bucket, destination_blob_name
-    )
-    print(
-        "Blob {} in bucket {} copied to blob {} in bucket {}.".format(
-            source_blob.name,
-            source_bucket.name,
-            blob_copy.name,
-            destination_bucket.name,
-        )
-    )
+product_index = load_product_index()
+# BigQuery is only queried without a product snapshot, e.g. not when running offline
+client = bigquery.Client() if product_index is None else None
+status_store = TaskStatusStore(BUCKET_NAME)
 
 
 @app.route("/")
@@ -54,65 +38,62 @@ def hello():
     return "Hello World!"
 
 
+@app.route("/metrics")
+def metrics():
+    """Metrics of this worker process, in the Prometheus text format."""
+    return Response(generate_latest(REGISTRY), content_type=CONTENT_TYPE_LATEST)
+
+
 @app.route("/imagery", methods=["POST"])
 def imagery():
-    """Entrypoint for the imagery worker.
-    Builds the query to filter images in BigQuery and wraps methods to perform augmentation
     """
-    images_to_upload = []
+    Entrypoint for the imagery worker. Records the task status around the actual work, along
+    with the time spent in each stage.
+    """
     payload = request.get_json()
     task_id = request.headers.get("X-Appengine-Taskname")
-    query = f"""SELECT image_id,
-                           gender,
-                           master_category,
-                           sub_category,
-                           article_type,
-                           base_colour,
-                           season,
-                           year,
-                           usage,
-                           display_name
-                    FROM tcc.products
-                    WHERE gender = '{payload["gender"]}' AND
-                          sub_category = '{payload["sub_category"]}' AND
-                          year = {payload["start_year"]}
-                    LIMIT {payload["limit"]}"""
-
-    metadata = []
-    logger.info("Query: %s", query)
-    query_job = client.query(query).result()
-    for row in query_job:
-        image_id = row.image_id
-        image_filename = f"{image_id}.jpg"
-        logger.info("Image Filename: %s", image_filename)
-        images_to_upload.append(image_filename)
-        metadata.append(
-            {
-                "image_id": row.image_id,
-                "gender": row.gender,
-                "master_category": row.master_category,
-                "sub_category": row.sub_category,
-                "article_type": row.article_type,
-                "base_colour": row.base_colour,
-                "season": row.season,
-                "year": row.year,
-                "usage": row.usage,
-                "display_name": row.display_name,
-            }
-        )
+    queue = request.headers.get("X-Appengine-Queuename")
+    timer = TaskTimer(task_id)
+    # the record holds the timer's stages, which fill up until the task is marked finished
+    with status_store.track(queue, task_id, stages_s=timer.stages), timer:
+        filter_images(payload, task_id, timer)
+
+    return jsonify({"task_id": task_id})
+
 
-    upload(images_to_upload, task_id, metadata)
+def filter_images(payload: dict, task_id: str, timer: Optional[TaskTimer] = None):
+    """
+    Filters images, in the local product snapshot if there is one and in BigQuery otherwise, and
+    wraps methods to perform augmentation
+
+    :param payload: imagery task payload
+    :param task_id: id of the specific run - will define the path in GCS
+    :param timer: timer of the task stages
+    """
+    timer = timer or TaskTimer(task_id)
+    if product_index is not None:
+        with timer.stage("product_index"):
+            metadata = product_index.filter(normalize_filter(payload))
+    else:
+        with timer.stage("bigquery"):
+            metadata = query_products(client, payload)
+    images_to_upload = [f"{product['image_id']}.jpg" for product in metadata]
+    logger.info("Found %d images", len(images_to_upload))
+
+    with timer.stage("metadata_upload"):
+        write_metadata(metadata, f"tasks/{task_id}/metadata.json")
+    with timer.stage("copy", items=len(images_to_upload)):
+        upload(images_to_upload, task_id)
     aug_conf = payload.get("augmentation_config")
     if aug_conf:
         logger.info("Starting augmentation")
         logger.info("AUG_CONF: %s", aug_conf)
-        run_augmentations(
-            aug_conf=aug_conf,
-            task_id=task_id,
-            metadata=metadata,
-        )
-
-    return jsonify({"task_id": task_id})
+        with timer.stage("augmentation", items=len(metadata)):
+            run_augmentations(
+                aug_conf=aug_conf,
+                task_id=task_id,
+                metadata=metadata,
+            )
 
 
 def run_augmentations(aug_conf: dict, metadata: list[dict], task_id: str):
@@ -123,74 +104,53 @@ def run_augmentations(aug_conf: dict, metadata: list[dict], task_id: str):
     :param metadata: list of dict resulted from querying BigQuery
     :param task_id: id of the specific run - will define the path in GCS
     """
-    storage_client = storage.Client()
-    source_bucket = storage_client.get_bucket(BUCKET_NAME)
-    destination_bucket = storage_client.get_bucket(BUCKET_NAME)
-
-    for res in metadata:
-        image_id = res["image_id"]
-        min_height = aug_conf["albumentation"]["cropping"]["height"]["min"]
-        max_height = aug_conf["albumentation"]["cropping"]["height"]["max"]
-        width_resized = aug_conf["albumentation"]["resize"]["width"]
-        height_resized = aug_conf["albumentation"]["resize"]["height"]
-        logger.info(f"Applying augmentation: {image_id}.jpg")
-        logger.info(f"min_height: {min_height}")
-        logger.info(f"max_height: {max_height}")
-        logger.info(f"Width after resize: {width_resized}")
-        logger.info(f"Height after resize: {height_resized}")
-        source_blob_path = f"tasks/{task_id}/images/{image_id}.jpg"
-
-        logger.info("SOURCE BLOB PATH: %s", source_blob_path)
-        source_blob = source_bucket.get_blob(source_blob_path)
-        logger.info("SOURCE BLOB: %s", source_blob)
-
-        original_img = source_blob.download_as_bytes()
-        image = np.asarray(Image.open(BytesIO(original_img)))
-
-        transform = A.Compose(
-            [
-                A.RandomSizedCrop(
-                    min_max_height=(min_height, max_height),
-                    height=height_resized,
-                    width=width_resized,
-                )
-            ]
-        )
-        random.seed(42)
-        _, augmented_image = cv2.imencode(".jpg", transform(image=image)["image"])
+    gateway = get_gateway()
+    logger.info(f"Applying augmentation to {len(metadata)} images: {aug_conf}")
+
+    def fetch(image_id):
+        return gateway.download(BUCKET_NAME, f"tasks/{task_id}/images/{image_id}.jpg")
 
-        destination_blob = source_bucket.blob(
-            f"tasks/{task_id}/augmentation/{image_id}.jpg"
+    def store(image_id, augmented_image):
+        gateway.upload(
+            BUCKET_NAME, f"tasks/{task_id}/augmentation/{image_id}.jpg", augmented_image
         )
-        print(
-            "AUGMENTATION - Blob {} in bucket {} copied to blob {} in bucket {}.".format(
-                source_blob.name,
-                source_bucket.name,
-                destination_blob.name,
-                destination_bucket.name,
-            )
+
+    failed = run_pipeline(
+        (res["image_id"] for res in metadata), aug_conf, fetch=fetch, store=store
+    )
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} of {len(metadata)} images could not be augmented"
         )
-        destination_blob.upload_from_string(augmented_image.tobytes())
 
 
-def upload(result: list, task_id: str, metadata: list[dict]):
+def upload(result: list, task_id: str):
     """
-    Uploads metadata and images for every run
+    Copies the images of a run under its prefix
 
-    :param result: list of dict resulted from querying postgres
+    :param result: names of the images of the run
     :param task_id: gcp path for specific run
-    :param metadata: task metadata
     :return: None
     """
-    metadata_path = f"tasks/{task_id}/metadata.json"
-    logger.info(f"Writing metadata into {metadata_path}")
-    write_metadata(metadata, metadata_path)
-
-    for image_id in result:
-        blob_name = f"images/{image_id}"
-        new_name = f"tasks/{task_id}/images/{image_id}"
-        logger.info(f"Copying {blob_name} into {new_name}")
-        copy_blob(blob_name, new_name)
+    copies = [
+        (f"images/{image_id}", f"tasks/{task_id}/images/{image_id}")
+        for image_id in result
+    ]
+    logger.info(f"Copying {len(copies)} images into tasks/{task_id}/images/")
+    summary = bulk_copy(
+        get_gateway(),
+        BUCKET_NAME,
+        copies,
+        concurrency=COPY_CONCURRENCY,
+        retries=COPY_RETRIES,
+    )
+    logger.info("Copy summary: %s", summary)
+    if summary.failed:
+        for blob_name, error in summary.failed.items():
+            logger.error("Failed to copy %s: %s", blob_name, error)
+        raise RuntimeError(
+            f"{len(summary.failed)} of {len(copies)} images could not be copied"
+        )
 
 
 def write_metadata(metadata, metadata_path):
@@ -199,10 +159,8 @@ def write_metadata(metadata, metadata_path):
     :param metadata: metadata to be written in GCS
     :param metadata_path: path to write metadata info about specific run
     """
-    storage_client = storage.Client()
-    bucket = storage_client.get_bucket(BUCKET_NAME)
-    blob = bucket.blob(metadata_path)
-    blob.upload_from_string(json.dumps(metadata))
+    logger.info("Writing metadata into %s", metadata_path)
+    get_gateway().upload(BUCKET_NAME, metadata_path, json.dumps(metadata))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+"""
+Local columnar snapshot of the product table, filtered in process
+
+A snapshot is a directory holding:
+
+    manifest.json               row count, and the dictionary of every column
+    <column>.codes.npy          dictionary code of every row
+    <column>.bitmaps.npy        one packed bitmap of the rows per dictionary value, for the
+                                filter columns and `year`
+
+Arrays are memory-mapped, so opening a snapshot is cheap and its pages are shared by all the
+threads of the worker. A filter is answered by AND-ing one bitmap per field, a year range by
+OR-ing the bitmaps of the years it covers.
+
+Refresh the snapshot from BigQuery with:
+
+    python product_index.py [path]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Iterable, Optional
+
+import numpy as np
+from google.cloud import bigquery
+
+from products import FILTER_COLUMNS, PRODUCT_COLUMNS, PRODUCTS_TABLE, ProductFilter
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PRODUCT_INDEX_PATH = os.getenv(
+    "PRODUCT_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "products_snapshot"),
+)
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+INDEXED_COLUMNS = FILTER_COLUMNS + ["year"]
+
+
+def write_snapshot(products: Iterable[dict], path: str) -> dict:
+    """
+    Writes a snapshot of `products`, replacing any snapshot already at `path`.
+
+    :param products: one dict per product, with every column of `PRODUCT_COLUMNS`
+    :param path: snapshot directory
+    :return: the manifest of the snapshot
+    """
+    products = list(products)
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix=".snapshot-")
+
+    manifest = {"version": SNAPSHOT_VERSION, "rows": len(products), "columns": {}}
+    for column in PRODUCT_COLUMNS:
+        values = [product.get(column) for product in products]
+        dictionary = list(dict.fromkeys(values))
+        codes_of = {value: code for code, value in enumerate(dictionary)}
+        codes = np.array(
+            [codes_of[value] for value in values], dtype=np.min_scalar_type(len(dictionary))
+        )
+        np.save(os.path.join(staging, f"{column}.codes.npy"), codes)
+        if column in INDEXED_COLUMNS:
+            bitmaps = np.packbits(
+                codes[np.newaxis, :] == np.arange(len(dictionary))[:, np.newaxis], axis=1
+            )
+            np.save(os.path.join(staging, f"{column}.bitmaps.npy"), bitmaps)
+        manifest["columns"][column] = {"dictionary": dictionary}
+
+    with open(os.path.join(staging, MANIFEST_NAME), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    previous = None
+    if os.path.exists(path):
+        previous = tempfile.mkdtemp(dir=parent, prefix=".previous-")
+        os.rename(path, os.path.join(previous, "snapshot"))
+    os.rename(staging, path)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+    logger.info("Wrote a snapshot of %d products into %s", len(products), path)
+    return manifest
+
+
+class ProductIndex:
+    """
+    Filters a product snapshot in memory.
+
+    :param path: snapshot directory
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST_NAME), encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported product snapshot version {manifest['version']}")
+
+        self.rows = manifest["rows"]
+        self._dictionaries = {
+            column: manifest["columns"][column]["dictionary"] for column in PRODUCT_COLUMNS
+        }
+        self._codes_of = {
+            column: {value: code for code, value in enumerate(dictionary)}
+            for column, dictionary in self._dictionaries.items()
+        }
+        self._codes = {
+            column: np.load(os.path.join(path, f"{column}.codes.npy"), mmap_mode="r")
+            for column in PRODUCT_COLUMNS
+        }
+        self._bitmaps = {
+            column: np.load(os.path.join(path, f"{column}.bitmaps.npy"), mmap_mode="r")
+            for column in INDEXED_COLUMNS
+        }
+        self._all_rows = np.packbits(np.ones(self.rows, dtype=bool))
+
+    def mask(self, product_filter: ProductFilter) -> np.ndarray:
+        """Returns the packed bitmap of the rows matching a filter, ignoring its limit."""
+        mask = self._all_rows.copy()
+        for column in FILTER_COLUMNS:
+            value = getattr(product_filter, column)
+            if value is None:
+                continue
+            code = self._codes_of[column].get(value)
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= self._bitmaps[column][code]
+
+        start_year, end_year = product_filter.start_year, product_filter.end_year
+        if start_year is not None or end_year is not None:
+            years = np.zeros_like(mask)
+            for code, year in enumerate(self._dictionaries["year"]):
+                if year is None:
+                    continue
+                if (start_year is None or year >= start_year) and (
+                    end_year is None or year <= end_year
+                ):
+                    years |= self._bitmaps["year"][code]
+            mask &= years
+        return mask
+
+    def filter(self, product_filter: ProductFilter) -> list[dict]:
+        """
+        Returns the products matching a filter, in snapshot order.
+
+        :param product_filter: normalized filter
+        :return: one dict per product, as returned by BigQuery
+        """
+        rows = np.flatnonzero(np.unpackbits(self.mask(product_filter), count=self.rows))
+        if product_filter.limit is not None:
+            rows = rows[: product_filter.limit]
+        columns = {
+            column: [self._dictionaries[column][code] for code in self._codes[column][rows]]
+            for column in PRODUCT_COLUMNS
+        }
+        return [
+            {column: columns[column][i] for column in PRODUCT_COLUMNS} for i in range(len(rows))
+        ]
+
+
+def load_product_index(path: str = PRODUCT_INDEX_PATH) -> Optional[ProductIndex]:
+    """Opens the snapshot at `path`, or returns None if there is none."""
+    if not os.path.exists(os.path.join(path, MANIFEST_NAME)):
+        logger.info("No product snapshot in %s, filtering in BigQuery", path)
+        return None
+    index = ProductIndex(path)
+    logger.info("Loaded a snapshot of %d products from %s", index.rows, path)
+    return index
+
+
+def refresh(client: bigquery.Client, path: str = PRODUCT_INDEX_PATH) -> dict:
+    """
+    Rebuilds the snapshot from the whole product table.
+
+    :param client: BigQuery client
+    :param path: snapshot directory
+    :return: the manifest of the snapshot
+    """
+    query = f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM {PRODUCTS_TABLE}"
+    products = client.query(query).result().to_arrow(create_bqstorage_client=True).to_pylist()
+    return write_snapshot(products, path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Rebuilds the local product snapshot")
+    parser.add_argument("path", nargs="?", default=PRODUCT_INDEX_PATH)
+    args = parser.parse_args()
+    snapshot = refresh(bigquery.Client(), args.path)
+    print(f"{snapshot['rows']} products written into {args.path}")
@@ -0,0 +1,166 @@
+"""Product metadata lookups in BigQuery for the imagery worker"""
+from __future__ import annotations
+
+import logging
+import os
+from typing import NamedTuple, Optional
+
+from google.cloud import bigquery
+
+from common.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PRODUCTS_TABLE = os.getenv("PRODUCTS_TABLE", "tcc.products")
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 3600))
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 256))
+BULK_FETCH_MIN_ROWS = int(os.getenv("BULK_FETCH_MIN_ROWS", 1000))
+
+PRODUCT_COLUMNS = [
+    "image_id",
+    "gender",
+    "master_category",
+    "sub_category",
+    "article_type",
+    "base_colour",
+    "season",
+    "year",
+    "usage",
+    "display_name",
+]
+
+FILTER_COLUMNS = [
+    "gender",
+    "master_category",
+    "sub_category",
+    "article_type",
+    "base_colour",
+    "season",
+    "usage",
+]
+
+cache = TTLCache(maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL)
+
+
+class ProductFilter(NamedTuple):
+    """
+    Normalized product filter of an imagery payload, hashable so it can key caches.
+
+    Unset fields do not filter. `start_year` alone selects that single year, as the worker always
+    did, `end_year` extends it into an inclusive range.
+    """
+
+    gender: Optional[str] = None
+    master_category: Optional[str] = None
+    sub_category: Optional[str] = None
+    article_type: Optional[str] = None
+    base_colour: Optional[str] = None
+    season: Optional[str] = None
+    usage: Optional[str] = None
+    start_year: Optional[int] = None
+    end_year: Optional[int] = None
+    limit: Optional[int] = None
+
+
+def _optional_int(value) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+def normalize_filter(payload: dict) -> ProductFilter:
+    """
+    Returns the part of an imagery payload the query depends on.
+
+    :param payload: imagery task payload
+    """
+    start_year = _optional_int(payload.get("start_year"))
+    end_year = _optional_int(payload.get("end_year"))
+    return ProductFilter(
+        **{column: payload.get(column) for column in FILTER_COLUMNS},
+        start_year=start_year,
+        end_year=start_year if end_year is None else end_year,
+        limit=_optional_int(payload.get("limit")),
+    )
+
+
+def build_query(product_filter: ProductFilter) -> tuple[str, list]:
+    """
+    Builds the parameterized query of a filter.
+
+    The query text only depends on which fields are set, never on their values.
+
+    :param product_filter: normalized filter
+    :return: query and its parameters
+    """
+    conditions = []
+    parameters = []
+    for column in FILTER_COLUMNS:
+        value = getattr(product_filter, column)
+        if value is not None:
+            conditions.append(f"{column} = @{column}")
+            parameters.append(bigquery.ScalarQueryParameter(column, "STRING", value))
+
+    start_year, end_year = product_filter.start_year, product_filter.end_year
+    if start_year is not None and start_year == end_year:
+        conditions.append("year = @year")
+        parameters.append(bigquery.ScalarQueryParameter("year", "INT64", start_year))
+    else:
+        if start_year is not None:
+            conditions.append("year >= @start_year")
+            parameters.append(bigquery.ScalarQueryParameter("start_year", "INT64", start_year))
+        if end_year is not None:
+            conditions.append("year <= @end_year")
+            parameters.append(bigquery.ScalarQueryParameter("end_year", "INT64", end_year))
+
+    query = f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM {PRODUCTS_TABLE}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if product_filter.limit is not None:
+        query += " LIMIT @limit"
+        parameters.append(bigquery.ScalarQueryParameter("limit", "INT64", product_filter.limit))
+    return query, parameters
+
+
+def fetch_products(client: bigquery.Client, product_filter: ProductFilter) -> list[dict]:
+    """
+    Runs the parameterized query of a filter.
+
+    Results of at least `BULK_FETCH_MIN_ROWS` rows are downloaded as a single Arrow table,
+    through the BigQuery Storage Read API, instead of page by page.
+
+    :param client: BigQuery client
+    :param product_filter: normalized filter
+    :return: one dict per product
+    """
+    query, parameters = build_query(product_filter)
+    job_config = bigquery.QueryJobConfig(query_parameters=parameters)
+    rows = client.query(query, job_config=job_config).result()
+    if rows.total_rows is not None and rows.total_rows >= BULK_FETCH_MIN_ROWS:
+        return rows.to_arrow(create_bqstorage_client=True).to_pylist()
+    return [{column: row[column] for column in PRODUCT_COLUMNS} for row in rows]
+
+
+def query_products(
+    client: bigquery.Client, payload: dict, products_cache: Optional[TTLCache] = None
+) -> list[dict]:
+    """
+    Returns the products matching the filter of an imagery payload.
+
+    Results are cached by normalized filter, so repeated filters skip BigQuery until the
+    entry expires.
+
+    :param client: BigQuery client
+    :param payload: imagery task payload
+    :param products_cache: result cache, the worker-wide one when omitted
+    :return: one dict per product
+    """
+    products_cache = cache if products_cache is None else products_cache
+    product_filter = normalize_filter(payload)
+    products = products_cache.get(product_filter)
+    if products is None:
+        logger.info("Querying products for %s", product_filter)
+        products = fetch_products(client, product_filter)
+        products_cache.set(product_filter, products)
+    else:
+        logger.info("Using cached products for %s", product_filter)
+    return [dict(product) for product in products]
@@ -0,0 +1,29 @@
+"""Create pytest fixtures"""
+import os
+import sys
+
+import pytest
+
+WORKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The worker is deployed with its own directory as the import root, next to a copy of src/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(WORKER_DIR)))
+sys.path.insert(0, WORKER_DIR)
+
+from common.storage import LocalGateway  # noqa: E402 pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    return LocalGateway(str(tmp_path))
+
+
+@pytest.fixture
+def aug_conf():
+    return {
+        "albumentation": {
+            "input_image": {"width": 60, "height": 80},
+            "cropping": {"height": {"min": 10, "max": 70}},
+            "resize": {"width": 256, "height": 256},
+        }
+    }
@@ -0,0 +1,83 @@
+"""Unit tests for the augmentation pipeline"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import augmentation
+from augmentation import run_pipeline
+
+
+def upload_images(gateway, count):
+    rng = np.random.default_rng(0)
+    for image_id in range(count):
+        image = rng.integers(0, 255, size=(160, 120, 3), dtype=np.uint8)
+        gateway.upload("bucket", f"images/{image_id}.jpg", cv2.imencode(".jpg", image)[1].tobytes())
+
+
+def augment_into(gateway, aug_conf, prefix, image_ids):
+    return run_pipeline(
+        image_ids,
+        aug_conf,
+        fetch=lambda image_id: gateway.download("bucket", f"images/{image_id}.jpg"),
+        store=lambda image_id, img: gateway.upload("bucket", f"{prefix}/{image_id}.jpg", img),
+        processes=0,
+        io_workers=3,
+        queue_size=2,
+    )
+
+
+def test_pipeline_augments_every_image_and_reports_failures(gateway, aug_conf):
+    """Every fetched image should be stored, missing ones reported"""
+    upload_images(gateway, 10)
+
+    failed = augment_into(gateway, aug_conf, "augmentation", list(range(11)))
+
+    assert list(failed) == [10]
+    assert len(gateway.list("bucket", "augmentation/")) == 10
+    image = cv2.imdecode(
+        np.frombuffer(gateway.download("bucket", "augmentation/0.jpg"), np.uint8),
+        cv2.IMREAD_COLOR,
+    )
+    assert image.shape == (256, 256, 3)
+
+
+def test_pipeline_is_deterministic_per_image(gateway, aug_conf):
+    """An image should get the same augmentation regardless of processing order"""
+    upload_images(gateway, 6)
+
+    augment_into(gateway, aug_conf, "first", list(range(6)))
+    augment_into(gateway, aug_conf, "second", list(reversed(range(6))))
+
+    for image_id in range(6):
+        assert gateway.download("bucket", f"first/{image_id}.jpg") == gateway.download(
+            "bucket", f"second/{image_id}.jpg"
+        )
+
+
+def test_pipeline_fails_images_a_shut_down_pool_rejects(gateway, aug_conf, monkeypatch):
+    """A pool shut down by another task should fail the images instead of hanging the request"""
+    upload_images(gateway, 4)
+    pool = ThreadPoolExecutor(max_workers=1)
+    pool.shutdown()
+    monkeypatch.setattr(augmentation, "process_pool", lambda processes: pool)
+    result = {}
+
+    def augment_all():
+        result["failed"] = run_pipeline(
+            range(4),
+            aug_conf,
+            fetch=lambda image_id: gateway.download("bucket", f"images/{image_id}.jpg"),
+            store=lambda image_id, img: None,
+            processes=1,
+            io_workers=2,
+            queue_size=1,
+        )
+
+    thread = threading.Thread(target=augment_all, daemon=True)
+    thread.start()
+    thread.join(10)
+
+    assert not thread.is_alive()
+    assert sorted(result["failed"]) == [0, 1, 2, 3]
@@ -0,0 +1,65 @@
+"""Unit tests for the local product snapshot"""
+import random
+
+from product_index import ProductIndex, write_snapshot
+from products import FILTER_COLUMNS, PRODUCT_COLUMNS, ProductFilter
+
+
+def make_products(count):
+    rng = random.Random(0)
+    products = []
+    for image_id in range(count):
+        product = {
+            column: rng.choice([f"{column}-{i}" for i in range(4)]) for column in PRODUCT_COLUMNS
+        }
+        product.update(image_id=image_id, year=rng.choice([2010, 2011, 2012, 2013, None]))
+        products.append(product)
+    return products
+
+
+def matches(product, product_filter):
+    for column in FILTER_COLUMNS:
+        value = getattr(product_filter, column)
+        if value is not None and product[column] != value:
+            return False
+    start_year, end_year = product_filter.start_year, product_filter.end_year
+    if start_year is None and end_year is None:
+        return True
+    year = product["year"]
+    return year is not None and (start_year is None or year >= start_year) and (
+        end_year is None or year <= end_year
+    )
+
+
+def test_index_matches_a_full_scan(tmp_path):
+    """Every filter, including year ranges, should select the rows a scan selects, in order"""
+    products = make_products(500)
+    write_snapshot(products, str(tmp_path / "snapshot"))
+    index = ProductIndex(str(tmp_path / "snapshot"))
+    rng = random.Random(1)
+
+    for _ in range(200):
+        fields = {
+            column: rng.choice([None, f"{column}-{rng.randrange(5)}"]) for column in FILTER_COLUMNS
+        }
+        start_year = rng.choice([None, 2009, 2011, 2012])
+        end_year = rng.choice([None, start_year, 2012, 2014])
+        product_filter = ProductFilter(
+            **fields, start_year=start_year, end_year=end_year, limit=rng.choice([None, 3])
+        )
+        expected = [product for product in products if matches(product, product_filter)]
+        if product_filter.limit is not None:
+            expected = expected[: product_filter.limit]
+        assert index.filter(product_filter) == expected
+
+
+def test_refresh_replaces_the_snapshot(tmp_path):
+    """Writing a snapshot over an existing one should replace it entirely"""
+    path = str(tmp_path / "snapshot")
+    write_snapshot(make_products(50), path)
+    write_snapshot(make_products(20), path)
+
+    index = ProductIndex(path)
+    assert index.rows == 20
+    assert len(index.filter(ProductFilter())) == 20
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["snapshot"]
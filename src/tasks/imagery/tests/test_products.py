@@ -0,0 +1,49 @@
+"""Unit tests for the product queries"""
+from common.cache import TTLCache
+from products import PRODUCT_COLUMNS, query_products
+
+
+class FakeRows(list):
+    @property
+    def total_rows(self):
+        return len(self)
+
+
+class FakeJob:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def result(self):
+        return FakeRows(self._rows)
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def query(self, query, job_config=None):
+        self.queries.append((query, job_config))
+        return FakeJob(self.rows)
+
+
+def test_query_is_parameterized_and_cached():
+    """Values should be bound as parameters, and repeated filters served from the cache"""
+    rows = [{column: f"{column}-{i}" for column in PRODUCT_COLUMNS} for i in range(3)]
+    client = FakeClient(rows)
+    cache = TTLCache(maxsize=10, ttl=60)
+    payload = {"gender": "Women'; --", "sub_category": "Dress", "start_year": "2012", "limit": 3}
+
+    products = query_products(client, payload, cache)
+    products[0]["image_id"] = "changed"
+    cached = query_products(client, dict(payload, start_year=2012, queue="other"), cache)
+
+    assert cached == rows
+    assert len(client.queries) == 1
+    query, job_config = client.queries[0]
+    assert "Women" not in query
+    parameters = {p.name: p.value for p in job_config.query_parameters}
+    assert parameters == {"gender": "Women'; --", "sub_category": "Dress", "year": 2012, "limit": 3}
+
+    query_products(client, dict(payload, limit=4), cache)
+    assert len(client.queries) == 2
@@ -1,24 +1,32 @@
 # pylint: disable-all
 """Implementation of FashionNetVgg16NoBn"""
+from typing import Optional, Tuple
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.nn import AdaptiveMaxPool2d
 from torchvision.models import vgg16
+from torchvision.ops import roi_pool
 
 ROI_POOL_SIZE = (3, 3)
 N_LANDMARKS = 8
 
 
-def adaptive_max_pool(input, size):
-    return AdaptiveMaxPool2d(size[0], size[1])(input)
-
-
-def gated_roi_pooling(input, rois, gates=None, size=ROI_POOL_SIZE, spatial_scale=1.0):
+def gated_roi_pooling(
+    input: torch.Tensor,
+    rois: torch.Tensor,
+    gates: Optional[torch.Tensor] = None,
+    size: Tuple[int, int] = ROI_POOL_SIZE,
+    spatial_scale: float = 1.0,
+) -> torch.Tensor:
     """
     Standard roi-pooling extended to accept a mask vector (gates) wich will set all activations
     to zero for corresponding features
 
+    All rois are pooled in a single batched call. Box corners are truncated to integers and the
+    far corner is clipped to the feature map, so each roi covers exactly the window that slicing
+    `input[..., y1:y2 + 1, x1:x2 + 1]` would select before adaptive max pooling it.
+
     :param input: features (for instance  feature maps from vgg/resnet
     :param rois: rois [batch_id, x1, y1, x2, y2]
     :param gates: mask vector with shape [len(gates), 1]
@@ -28,29 +36,31 @@ def gated_roi_pooling(input, rois, gates=None, size=ROI_POOL_SIZE, spatial_scale
     """
     assert rois.dim() == 2
     assert rois.size(1) == 5
-    output = []
-    rois = rois.data.float()
-    num_rois = rois.size(0)
-
-    rois[:, 1:].mul_(spatial_scale)
-    rois = rois.long()
-    for i in range(num_rois):
-        roi = rois[i]
-        im_idx = roi[0]
-        im = input.narrow(0, im_idx, 1)[
-            ..., roi[2] : (roi[4] + 1), roi[1] : (roi[3] + 1)
-        ]
-        mp = adaptive_max_pool(im, size)[0]
-        output.append(mp)
-
-    pooled_features = torch.cat(output, 0)
+    height, width = input.shape[-2:]
+    rois = rois.detach().float()
+
+    coords = (rois[:, 1:] * spatial_scale).long()
+    boxes = torch.stack(
+        [
+            rois[:, 0].long(),
+            coords[:, 0],
+            coords[:, 1],
+            coords[:, 2].clamp(max=width - 1),
+            coords[:, 3].clamp(max=height - 1),
+        ],
+        dim=1,
+    ).to(input.dtype)
+
+    pooled_features = roi_pool(input, boxes, output_size=size, spatial_scale=1.0)
     if gates is not None:
-        pooled_features[gates.flatten()] = 0
+        pooled_features = pooled_features.masked_fill(
+            gates.reshape(-1, 1, 1, 1).to(torch.bool), 0
+        )
 
-    return pooled_features.view(input.shape[0], -1, ROI_POOL_SIZE[0], ROI_POOL_SIZE[1])
+    return pooled_features.view(input.shape[0], -1, size[0], size[1])
 
 
-def landmark_predictions_to_roipool_boxes(landmark_loc, bbs=0):
+def landmark_predictions_to_roipool_boxes(landmark_loc: torch.Tensor, bbs: int = 0) -> torch.Tensor:
     """
     Basically what we are doing here is translating the landmark location predictions (basically
     a vector of [BS, 16])
@@ -61,24 +71,20 @@ def landmark_predictions_to_roipool_boxes(landmark_loc, bbs=0):
     bbs parameter
     :param landmark_loc:  [BS, 16]
     :param bbs: size of the bounding box
-    :return:
+    :return: [BS * 8, 5] boxes, each tagged with the index of its sample in the batch
     """
-    collect = []
-    for batch_ix, landmark_position in enumerate(
-        landmark_loc.reshape(-1, 2).unsqueeze(0)
-    ):
-        for landmark_pair in landmark_position:
-            x, y = landmark_pair
-            x, y = int(x / 16), int(y / 16)
-            box = torch.Tensor([batch_ix, x - bbs, y - bbs, x + bbs, y + bbs])
-            box.clamp_(min=0)
-            collect.append(box)
-    to_roi_pool = torch.stack(collect)
+    batch_size = landmark_loc.size(0)
+    points = torch.trunc(landmark_loc.detach().float().reshape(batch_size, -1, 2) / 16)
+    offsets = torch.tensor([-bbs, -bbs, bbs, bbs], dtype=points.dtype, device=points.device)
+    corners = (points.repeat(1, 1, 2) + offsets).clamp(min=0)
+    batch_ix = torch.arange(batch_size, device=points.device, dtype=points.dtype)
+    batch_ix = batch_ix.view(-1, 1, 1).expand(-1, points.size(1), 1)
+    to_roi_pool = torch.cat([batch_ix, corners], dim=2).reshape(-1, 5)
     return to_roi_pool
 
 
 class Flatten(nn.Module):
-    def forward(self, input):
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
         return input.view(input.size(0), -1)
 
 
@@ -109,10 +115,43 @@ class FashionNetVgg16NoBn(nn.Module):
         self.categories = nn.Linear(in_features=5120, out_features=50)
 
         self.flatten = Flatten()
+        self.conv5_shared = self.conv5_is_shared()
+
+    def conv5_is_shared(self) -> bool:
+        """
+        Tells whether conv5_pose and conv5_global are the same layers, holding the same parameters.
+
+        They are built that way, so a single conv5 pass serves both branches, while fine-tuned
+        variants with untied weights keep one pass per branch.
+        """
+        if len(self.conv5_pose) != len(self.conv5_global):
+            return False
+        for pose, glob in zip(self.conv5_pose, self.conv5_global):
+            if pose is glob:
+                continue
+            if repr(pose) != repr(glob):
+                return False
+            if list(map(id, pose.parameters())) != list(map(id, glob.parameters())):
+                return False
+        return True
+
+    def __prepare_scriptable__(self):
+        # TorchScript cannot compare parameters by identity, scripted models check once instead
+        self.conv5_shared = self.conv5_is_shared()
+        return self
 
     def forward(self, x):
         base_features = self.conv4(x)
-        pose = self.flatten(self.conv5_pose(base_features))
+        if torch.jit.is_scripting():
+            conv5_shared = self.conv5_shared
+        else:
+            conv5_shared = self.conv5_is_shared()
+        conv5_pose = self.conv5_pose(base_features)
+        if conv5_shared:
+            conv5_global = conv5_pose
+        else:
+            conv5_global = self.conv5_global(base_features)
+        pose = self.flatten(conv5_pose)
 
         pose = F.leaky_relu(self.fc6_pose(pose))
         pose = F.leaky_relu(self.fc7_pose(pose))
@@ -126,9 +165,7 @@ class FashionNetVgg16NoBn(nn.Module):
         pools = gated_roi_pooling(base_features, roi_boxes, pose_vis < -1000)
 
         fc6_local = F.leaky_relu(self.fc6_local(self.flatten(pools)))
-        fc6_global = F.leaky_relu(
-            self.fc6_global(self.flatten(self.conv5_global(base_features)))
-        )
+        fc6_global = F.leaky_relu(self.fc6_global(self.flatten(conv5_global)))
 
         global_and_local = torch.cat([fc6_local, fc6_global], dim=1)
 
@@ -0,0 +1,86 @@
+"""
+TorchScript export of the inference models
+
+`torchscript` compiles the whole forward pass, landmark to roi conversion and roi pooling included,
+and freezes it: weights become constants of the graph, and the pass no longer goes through Python.
+Frozen models are optimized for the CPU they are loaded on, e.g. with convolutions pre-packed for
+oneDNN, so artifacts hold the portable frozen graph and get optimized when they are loaded.
+
+Export a model into an artifact the worker can serve through `MODEL_URI` with:
+
+    python export.py <output.pt> [--model-uri default] [--precision float32]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+EAGER = "eager"
+TORCHSCRIPT = "torchscript"
+RUNTIMES = (EAGER, TORCHSCRIPT)
+ARTIFACT_SUFFIX = ".pt"
+
+
+def compile_model(model: torch.nn.Module, runtime: str) -> torch.nn.Module:
+    """
+    Returns `model` compiled for the given runtime.
+
+    :param model: eager model
+    :param runtime: one of `RUNTIMES`
+    """
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown runtime {runtime!r}, expected one of {RUNTIMES}")
+    if runtime == EAGER:
+        return model
+    return optimize(freeze(model))
+
+
+def freeze(model: torch.nn.Module) -> torch.jit.ScriptModule:
+    """Compiles and freezes an eager model into the portable form artifacts are saved in."""
+    return torch.jit.freeze(torch.jit.script(model.eval()))
+
+
+def optimize(frozen: torch.jit.ScriptModule) -> torch.jit.ScriptModule:
+    """Optimizes a frozen model for inference on the current CPU."""
+    return torch.jit.optimize_for_inference(frozen)
+
+
+def load_artifact(path: str) -> torch.jit.ScriptModule:
+    """Loads an exported artifact, ready for inference."""
+    return optimize(torch.jit.load(path, map_location="cpu"))
+
+
+def parity(reference: torch.nn.Module, compiled: torch.nn.Module, images: torch.Tensor) -> list:
+    """Returns the max absolute difference between the outputs of two models on `images`."""
+    with torch.no_grad():
+        expected = reference(images)
+        actual = compiled(images)
+    return [(e - a).abs().max().item() for e, a in zip(expected, actual)]
+
+
+if __name__ == "__main__":
+    # pylint: disable=import-outside-toplevel
+    from quantization import FLOAT32, PRECISIONS
+    from registry import DEFAULT_MODEL_URI, load_model
+
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Exports a model as a TorchScript artifact")
+    parser.add_argument("output", help=f"artifact path, ending with {ARTIFACT_SUFFIX}")
+    parser.add_argument("--model-uri", default=DEFAULT_MODEL_URI)
+    parser.add_argument("--precision", default=FLOAT32, choices=PRECISIONS)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    eager_model = load_model(args.model_uri, precision=args.precision)
+    torch.jit.save(freeze(eager_model), args.output)
+    errors = parity(eager_model, load_artifact(args.output), torch.rand(4, 3, 224, 224) * 255)
+    print(f"Max abs error against the eager model: {errors}")
+    if max(errors) > args.tolerance:
+        raise SystemExit(f"Exported model is off by more than {args.tolerance}")
+    print(f"Exported {args.model_uri} ({args.precision}) into {args.output}")
@@ -2,28 +2,83 @@
 """"App Engine app to serve inference worker."""
 from __future__ import annotations
 
+import base64
+import binascii
+import functools
 import json
 import logging
 import os
+import time
+from concurrent.futures import wait
+from typing import Optional
 
 import mlflow
+import numpy as np
 import torch
-from flask import Flask, request
-from google.cloud import storage
+from flask import Flask, Response, jsonify, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 from torch.utils.data import DataLoader
 
-from deepfashion import FashionNetVgg16NoBn
-from utils.categories_mapping import master_categories
-from utils.dataset import ImagesDataset, download_blob_into_memory
-from PIL import Image
-from io import BytesIO
+from common.metrics import TaskTimer, histogram
+from common.results import ResultWriter
+from common.status import TaskStatusStore
+from common.storage import get_gateway, is_not_found
+from export import EAGER
+from micro_batcher import MicroBatcher, QueueFull
+from prediction_cache import content_hash, load_prediction_cache
+from quantization import FLOAT32
+from registry import DEFAULT_MODEL_URI, ModelRegistry, load_model
+from utils.artifacts import ArtifactLogger
+from utils.dataset import (
+    IMAGE_SIZE,
+    PREPROCESSING_VERSION,
+    ImagesDataset,
+    dataloader_options,
+    prepare_image,
+    to_float,
+)
+from utils.postprocessing import postprocess
 
 BUCKET_NAME = os.getenv("BUCKET_NAME")
+MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://35.229.28.6:5000")
+MODEL_URI = os.getenv("MODEL_URI", DEFAULT_MODEL_URI)
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", FLOAT32)
+MODEL_RUNTIME = os.getenv("MODEL_RUNTIME", EAGER)
+MODEL_REGISTRY_MAX_BYTES = int(os.getenv("MODEL_REGISTRY_MAX_BYTES", 4 * 1024**3))
+LOADER_DEFAULTS = {
+    "batch_size": int(os.getenv("INFERENCE_BATCH_SIZE", 16)),
+    "num_workers": int(os.getenv("INFERENCE_NUM_WORKERS", 4)),
+    "prefetch_factor": int(os.getenv("INFERENCE_PREFETCH_FACTOR", 2)),
+}
+ARTIFACT_CHUNK_SIZE = int(os.getenv("MLFLOW_ARTIFACT_CHUNK_SIZE", 0))
+ARTIFACT_READ_BACK = os.getenv("MLFLOW_ARTIFACT_READ_BACK", "false").lower() == "true"
+ARTIFACT_QUEUE_SIZE = int(os.getenv("MLFLOW_ARTIFACT_QUEUE_SIZE", 256))
+RESULT_FORMAT = os.getenv("INFERENCE_RESULT_FORMAT", "sharded")
+RESULT_SHARD_SIZE = int(os.getenv("INFERENCE_RESULT_SHARD_SIZE", 1024))
+# 0 for the full output vectors, otherwise only the top k categories and attributes
+TOP_K = int(os.getenv("INFERENCE_TOP_K", 0))
+# synchronous predictions, see /predict/images
+PREDICT_MAX_BATCH_SIZE = int(os.getenv("PREDICT_MAX_BATCH_SIZE", 16))
+PREDICT_MAX_DELAY_MS = float(os.getenv("PREDICT_MAX_DELAY_MS", 5))
+PREDICT_MAX_QUEUE = int(os.getenv("PREDICT_MAX_QUEUE", 256))
+PREDICT_MAX_IMAGES = int(os.getenv("PREDICT_MAX_IMAGES", 64))
+PREDICT_TIMEOUT = float(os.getenv("PREDICT_TIMEOUT", 30))
+VECTOR_COLUMNS = ["massive_attr", "categories"]
 app = Flask(__name__)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-mlflow.set_tracking_uri("http://35.229.28.6:5000")
+registry = ModelRegistry(
+    max_bytes=MODEL_REGISTRY_MAX_BYTES,
+    loader=functools.partial(load_model, precision=MODEL_PRECISION, runtime=MODEL_RUNTIME),
+)
+status_store = TaskStatusStore(BUCKET_NAME)
+prediction_cache = load_prediction_cache(PREPROCESSING_VERSION)
+PREDICT_SECONDS = histogram(
+    "predict_request_seconds", "Latency of synchronous predictions, per status code", ["code"]
+)
+
+mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
 
 
 @app.route("/")
@@ -32,70 +87,353 @@ def hello():
     return "Hello World!"
 
 
+@app.route("/metrics")
+def metrics():
+    """Metrics of this worker process, in the Prometheus text format."""
+    return Response(generate_latest(REGISTRY), content_type=CONTENT_TYPE_LATEST)
+
+
+@app.route("/predict/images", methods=["POST"])
+def predict_images():
+    """
+    Predicts images synchronously, with the model of `MODEL_URI`.
+
+    Images are sent either as multipart files named `images`, or as a json body with `images`, a
+    list of base64 encoded images, or `blob_names`, a list of blobs of the worker bucket. The
+    optional `top_k` (a form field or json key) adds the best categories and attributes of every
+    image, see `utils.postprocessing`.
+
+    Images missing from the prediction cache go through the micro-batcher, which shares forward
+    passes between concurrent requests. The worker answers 503 when its queue is full, 504 when
+    the prediction takes longer than `PREDICT_TIMEOUT`, 500 when it fails.
+    """
+    start = time.perf_counter()
+    try:
+        response = _predict_images()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Synchronous prediction failed")
+        response = jsonify({"error": "Prediction failed"}), 500
+    PREDICT_SECONDS.labels(code=response[1]).observe(time.perf_counter() - start)
+    return response
+
+
+def _predict_images():
+    try:
+        names, contents, top_k = read_prediction_request()
+    except (ValueError, TypeError, binascii.Error) as error:
+        return jsonify({"error": f"Invalid request: {error}"}), 400
+    except FileNotFoundError as error:
+        return jsonify({"error": f"No blob {error}"}), 404
+    if not contents:
+        return jsonify({"error": "No images"}), 400
+    if len(contents) > PREDICT_MAX_IMAGES:
+        return jsonify({"error": f"At most {PREDICT_MAX_IMAGES} images per request"}), 413
+    try:
+        images = [prepare_image(image_bytes) for image_bytes in contents]
+    except (OSError, ValueError) as error:
+        return jsonify({"error": f"Could not decode images: {error}"}), 400
+    expected_shape = (3, IMAGE_SIZE[1], IMAGE_SIZE[0])
+    if any(tuple(image.shape) != expected_shape for image in images):
+        return jsonify({"error": "Images must be RGB"}), 400
+
+    _, model_version = registry.get_versioned(MODEL_URI)
+    shared = shares_predictions(MODEL_URI)
+    hashes = [content_hash(image_bytes) for image_bytes in contents]
+    predictions = {}
+    if prediction_cache is not None:
+        predictions = prediction_cache.get_many(model_version, hashes, shared)
+    versions = dict.fromkeys(predictions, model_version)
+    misses = {}
+    for ix, image_hash in enumerate(hashes):
+        if image_hash not in predictions:
+            misses.setdefault(image_hash, images[ix])
+    if misses:
+        try:
+            futures = batcher.submit(list(misses.values()))
+        except QueueFull as error:
+            return jsonify({"error": str(error)}), 503, {"Retry-After": "1"}
+        _, not_done = wait(futures, timeout=PREDICT_TIMEOUT)
+        if not_done:
+            # images still queued are dropped rather than predicted for nobody
+            for future in not_done:
+                future.cancel()
+            return jsonify({"error": "Prediction timed out"}), 504
+        try:
+            results = [future.result() for future in futures]
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Prediction batch failed")
+            return jsonify({"error": "Prediction failed"}), 500
+        # the model may have been reloaded since the lookup, predictions are cached under the
+        # version of the weights that made them
+        computed = {}
+        for image_hash, (version, prediction) in zip(misses, results):
+            computed.setdefault(version, {})[image_hash] = prediction
+            versions[image_hash] = version
+            predictions[image_hash] = prediction
+        if prediction_cache is not None:
+            for version, version_predictions in computed.items():
+                prediction_cache.put_many(version, version_predictions, shared)
+
+    vectors = {
+        column: np.stack([predictions[image_hash][column] for image_hash in hashes])
+        for column in VECTOR_COLUMNS
+    }
+    fields = postprocess(vectors, top_k)
+    image_versions = [versions[image_hash] for image_hash in hashes]
+    return (
+        jsonify(
+            {
+                # null when the model changed while the images were predicted
+                "model_version": image_versions[0] if len(set(image_versions)) == 1 else None,
+                "predictions": [
+                    {"image": name, "model_version": version, **image_fields}
+                    for name, version, image_fields in zip(names, image_versions, fields)
+                ],
+            }
+        ),
+        200,
+    )
+
+
+def read_prediction_request() -> tuple[list, list[bytes], int]:
+    """Returns the names, bytes and requested top k of the images of a `/predict/images` call."""
+    if request.files:
+        files = request.files.getlist("images")
+        top_k = validate_top_k(int(request.form.get("top_k", 0)))
+        return [file.filename for file in files], [file.read() for file in files], top_k
+
+    body = request.get_json(force=True, silent=True)
+    if not isinstance(body, dict):
+        raise ValueError("expected multipart images or a json object")
+    top_k = validate_top_k(int(body.get("top_k") or 0))
+    if body.get("blob_names"):
+        names = list(body["blob_names"])
+        return names, [download_image(name) for name in names], top_k
+    images = body.get("images") or []
+    return list(range(len(images))), [base64.b64decode(image) for image in images], top_k
+
+
+def validate_top_k(top_k: int) -> int:
+    """Returns `top_k`, raising ValueError when it is negative."""
+    if top_k < 0:
+        raise ValueError(f"top_k must be positive or 0, got {top_k}")
+    return top_k
+
+
+def download_image(blob_name: str) -> bytes:
+    """Downloads an image of the worker bucket, raising FileNotFoundError when it is missing."""
+    try:
+        return get_gateway().download(BUCKET_NAME, blob_name)
+    except Exception as error:
+        if is_not_found(error):
+            raise FileNotFoundError(blob_name) from error
+        raise
+
+
+def forward_batch(images: list[torch.Tensor]) -> list[tuple[str, dict]]:
+    """
+    Batch function of the micro-batcher: runs the model of `MODEL_URI` on a batch of images.
+
+    :return: version of the model that ran and outputs, per image
+    """
+    fn, version = registry.get_versioned(MODEL_URI)
+    with torch.no_grad():
+        output = fn(to_float(torch.stack(images)))
+    outputs = [tensor.numpy() for tensor in output[: len(VECTOR_COLUMNS)]]
+    return [
+        (version, {column: outputs[col][row] for col, column in enumerate(VECTOR_COLUMNS)})
+        for row in range(len(images))
+    ]
+
+
+batcher = MicroBatcher(
+    forward_batch,
+    max_batch_size=PREDICT_MAX_BATCH_SIZE,
+    max_delay=PREDICT_MAX_DELAY_MS / 1000,
+    max_queue=PREDICT_MAX_QUEUE,
+)
+
+
 @app.route("/inference", methods=["POST"])
 def inference_task():
-    """Entrypoint for the inference Cloud Task."""
+    """
+    Entrypoint for the inference Cloud Task. Records the task status around the inference, along
+    with the time spent in each stage.
+    """
     payload = request.get_json()
-    task_id = payload["task_id"]
-    logger.info("Running inference for task_id: %s", task_id)
+    queue = request.headers.get("X-Appengine-Queuename")
+    cloud_task_id = request.headers.get("X-Appengine-Taskname")
+    timer = TaskTimer(cloud_task_id)
+    prefix = results_prefix(payload["task_id"], cloud_task_id)
+    # the record holds the timer's stages, which fill up until the task is marked finished
+    with status_store.track(
+        queue,
+        cloud_task_id,
+        run_id=payload["task_id"],
+        results_prefix=prefix,
+        stages_s=timer.stages,
+    ) as record, timer:
+        record["mlflow_run_id"] = run_inference(payload, timer, prefix)
+
+    return {
+        "run_id": payload["task_id"],
+        "results_prefix": prefix,
+        "mlflow_run_id": record["mlflow_run_id"],
+    }
+
+
+def results_prefix(task_id: str, cloud_task_id: Optional[str] = None) -> str:
+    """
+    Returns where an inference task writes its results.
 
-    fn = FashionNetVgg16NoBn()
+    Inference tasks on the same imagery run, e.g. of different models, each get their own
+    `tasks/<task_id>/inferences/<cloud_task_id>/` prefix. Without a Cloud Task, results go to
+    `tasks/<task_id>/inferences/`.
 
-    for k in fn.state_dict().keys():
-        if "conv5_pose" in k and "weight" in k:
-            torch.nn.init.xavier_normal_(fn.state_dict()[k])
+    :param task_id: imagery run the inference predicts
+    :param cloud_task_id: id of the inference Cloud Task
+    """
+    if cloud_task_id:
+        return f"tasks/{task_id}/inferences/{cloud_task_id}/"
+    return f"tasks/{task_id}/inferences/"
+
+
+def run_inference(
+    payload: dict, timer: Optional[TaskTimer] = None, output_prefix: Optional[str] = None
+) -> str:
+    """
+    Runs the model over the images of an imagery run and uploads the predictions.
+
+    :param payload: inference task payload, `task_id` being the imagery run to predict
+    :param timer: timer of the task stages
+    :param output_prefix: destination of the results, see `results_prefix`
+    :return: id of the MLflow run of the inference
+    """
+    timer = timer or TaskTimer(payload["task_id"])
+    task_id = payload["task_id"]
+    logger.info("Running inference for task_id: %s", task_id)
+    # invalid options fail the task before any work
+    top_k = validate_top_k(payload["top_k"]) if payload.get("top_k") is not None else TOP_K
+    loader_options = dataloader_options(payload, LOADER_DEFAULTS)
 
-    for k in fn.state_dict().keys():
-        if "conv5_global" in k and "weight" in k:
-            torch.nn.init.xavier_normal_(fn.state_dict()[k])
+    model_uri = payload.get("model_uri") or MODEL_URI
+    logger.info("Using model: %s", model_uri)
+    with timer.stage("model_load"):
+        fn, model_version = registry.get_versioned(model_uri)
 
     images_filepaths = []
     prefix = f"tasks/{task_id}/"
-    images_filepaths = list_blobs_with_prefix(BUCKET_NAME, prefix, images_filepaths)
-    logger.info("Images for task_id: %s", task_id)
-    for img in images_filepaths:
-        logger.info(img)
+    with timer.stage("list_blobs"):
+        images_filepaths = list_blobs_with_prefix(BUCKET_NAME, prefix, images_filepaths)
+    logger.info("Found %d images for task_id: %s", len(images_filepaths), task_id)
 
     images_dataset = ImagesDataset(images_filepaths=images_filepaths)
-    loader = DataLoader(images_dataset)
-    predicted_labels = []
-    with mlflow.start_run(
-        run_name="MBA FashionNet V1",
-        description="MBA FashionNet V1 - Category Classification",
-        tags={"version": "v1", "augmentation": "no", "augmentation_config": "n/a"},
-    ) as run:
-        artifact_uri = run.info.artifact_uri
+    logger.info("DataLoader options: %s", loader_options)
+    loader = DataLoader(images_dataset, **loader_options)
+    result_format = payload.get("result_format") or RESULT_FORMAT
+    # the top k predictions replace the full vectors, in the records
+    vector_columns = [] if top_k else VECTOR_COLUMNS
+    with timer.stage("mlflow_logging"):
+        run = mlflow.start_run(
+            run_name="MBA FashionNet V1",
+            description="MBA FashionNet V1 - Category Classification",
+            tags={"version": "v1", "augmentation": "no", "augmentation_config": "n/a"},
+        )
+    with timer.exiting("mlflow_logging", run):
         mlflow_run_id = run.info.run_id
-        with torch.no_grad():
-            for image, image_name in loader:
-                output = fn(image)
-                categories_list = output[1].tolist()[0]
-                max_pred = max(categories_list)
-                category_prediction_index = categories_list.index(max_pred)
-                category_prediction = master_categories[category_prediction_index]
-                predicted_label = {
-                    "image_name": image_name,
-                    "massive_attr": output[0].tolist()[0],
-                    "categories": categories_list,
-                    "category_prediction_index": category_prediction_index,
-                    "category_prediction": category_prediction,
-                    "mlflow_run_id": mlflow_run_id,
-                }
-                predicted_labels.append(predicted_label)
-                img_name = image_name[0].rsplit("/", 1)[1].replace(".jpg", "")
-                img_bytes = download_blob_into_memory("tcc-clothes", image_name[0])
-                mlflow.log_image(
-                    Image.open(BytesIO(img_bytes)), f"images/{img_name}.jpg"
+        artifact_logger = ArtifactLogger(
+            mlflow_run_id,
+            chunk_size=ARTIFACT_CHUNK_SIZE,
+            read_back=ARTIFACT_READ_BACK,
+            max_pending=ARTIFACT_QUEUE_SIZE,
+        )
+        writer = result_writer(result_format, task_id, vector_columns, output_prefix)
+        with timer.exiting("result_upload", writer), timer.exiting(
+            "mlflow_logging", artifact_logger
+        ), torch.no_grad():
+            for images, image_names, images_bytes, timings in timer.iterate("data_wait", loader):
+                for stage, seconds in timings.items():
+                    for image_seconds in seconds.tolist():
+                        timer.add(stage, image_seconds, items=1)
+                hashes = [content_hash(image_bytes) for image_bytes in images_bytes]
+                vectors = predict_batch(
+                    fn, model_version, images, hashes, timer, shares_predictions(model_uri)
                 )
-                mlflow.artifacts.load_image(artifact_uri + f"/images/{img_name}.jpg")
-                mlflow.log_dict(predicted_label, f"inferences/{img_name}.json")
-                mlflow.artifacts.load_dict(
-                    artifact_uri + f"/inferences/{img_name}.json"
-                )
-        mlflow.log_metric(key="AUC", value=0.7)
-    upload_inferences(result=predicted_labels, task_id=task_id)
+                with timer.stage("postprocess", items=len(image_names)):
+                    records = [
+                        {"image_name": [image_name], **fields, "mlflow_run_id": mlflow_run_id}
+                        for image_name, fields in zip(image_names, postprocess(vectors, top_k))
+                    ]
+                for ix, (image_name, record) in enumerate(zip(image_names, records)):
+                    predicted_label = dict(record)
+                    for column in vector_columns:
+                        predicted_label[column] = vectors[column][ix].tolist()
+                    img_name = image_name.rsplit("/", 1)[1].replace(".jpg", "")
+                    with timer.stage("mlflow_logging"):
+                        artifact_logger.log_image_bytes(
+                            images_bytes[ix], f"images/{img_name}.jpg"
+                        )
+                        artifact_logger.log_dict(
+                            predicted_label, f"inferences/{img_name}.json"
+                        )
+                with timer.stage("result_upload"):
+                    writer.write_batch(records, vectors)
+        with timer.stage("mlflow_logging"):
+            mlflow.log_metric(key="AUC", value=0.7)
+    return mlflow_run_id
+
+
+def predict_batch(
+    fn,
+    model_version: str,
+    images: torch.Tensor,
+    hashes: list[str],
+    timer: TaskTimer,
+    shared: bool = False,
+) -> dict:
+    """
+    Predicts a batch of images, only running the model on the ones missing from the prediction
+    cache, and caching the predictions it makes.
+
+    :param fn: model
+    :param model_version: fingerprint of the model, see `registry.model_fingerprint`
+    :param images: uint8 batch of images
+    :param hashes: content hash of every image of the batch
+    :param timer: timer of the task stages
+    :param shared: whether to use the shared tier of the cache, see `shares_predictions`
+    :return: outputs of the batch, a float32 matrix per column of `VECTOR_COLUMNS`
+    """
+    predictions = {}
+    if prediction_cache is not None:
+        with timer.stage("cache_lookup", items=len(hashes)):
+            predictions = prediction_cache.get_many(model_version, hashes, shared)
+    misses = [ix for ix, image_hash in enumerate(hashes) if image_hash not in predictions]
+    if misses:
+        with timer.stage("forward", items=len(misses)):
+            output = fn(to_float(images[misses] if len(misses) < len(hashes) else images))
+        outputs = [tensor.numpy() for tensor in output[: len(VECTOR_COLUMNS)]]
+        computed = {
+            hashes[ix]: {column: outputs[col][row] for col, column in enumerate(VECTOR_COLUMNS)}
+            for row, ix in enumerate(misses)
+        }
+        if prediction_cache is not None:
+            with timer.stage("cache_store", items=len(computed)):
+                prediction_cache.put_many(model_version, computed, shared)
+        predictions.update(computed)
+    return {
+        column: np.stack([predictions[image_hash][column] for image_hash in hashes])
+        for column in VECTOR_COLUMNS
+    }
+
+
+def shares_predictions(model_uri: str) -> bool:
+    """
+    Returns whether the predictions of a model go to the shared tier of the prediction cache.
 
-    return {"run_id": task_id}
+    The default model is initialised randomly on every start, so its version never comes back and
+    its entries would only pile up in the bucket.
+    """
+    return model_uri != DEFAULT_MODEL_URI
 
 
 def list_blobs_with_prefix(bucket_name, prefix, images_filepaths, delimiter=None):
@@ -126,33 +464,86 @@ def list_blobs_with_prefix(bucket_name, prefix, images_filepaths, delimiter=None
         a/b/
     """
 
-    storage_client = storage.Client()
-    blobs = storage_client.list_blobs(bucket_name, prefix=prefix, delimiter=delimiter)
+    blob_names = get_gateway().list(bucket_name, prefix=prefix, delimiter=delimiter)
 
     # v1: without augmentation
     # v2: with augmentation
-    for blob in blobs:
-        if ".jpg" in blob.name and "augmentation" not in blob.name:
-            images_filepaths.append(blob.name)
+    for blob_name in blob_names:
+        if ".jpg" in blob_name and "augmentation" not in blob_name:
+            images_filepaths.append(blob_name)
     return images_filepaths
 
 
-def upload_inferences(result: list[dict], task_id: str) -> None:
+def result_writer(
+    result_format: str,
+    task_id: str,
+    vector_columns: list[str] = VECTOR_COLUMNS,
+    prefix: Optional[str] = None,
+):
+    """
+    Creates the writer for the results of a task.
+
+    :param result_format: `sharded` for shards under the prefix (see `common.results`), `json`
+        for a single `<prefix>.json` file, e.g. `tasks/<task_id>/inferences.json`
+    :param task_id: id for the run
+    :param vector_columns: output vectors written along with the records
+    :param prefix: destination of the results, `tasks/<task_id>/inferences/` by default
+    """
+    prefix = prefix or results_prefix(task_id)
+    if result_format == "json":
+        return JsonResultWriter(task_id, vector_columns, path=f"{prefix.rstrip('/')}.json")
+    return ResultWriter(
+        get_gateway(),
+        BUCKET_NAME,
+        prefix,
+        vector_columns=vector_columns,
+        shard_size=RESULT_SHARD_SIZE,
+    )
+
+
+class JsonResultWriter:
+    """Collects every prediction into a single json list, as earlier versions did."""
+
+    def __init__(
+        self, task_id: str, vector_columns: list[str] = VECTOR_COLUMNS, path: Optional[str] = None
+    ):
+        self._task_id = task_id
+        self._vector_columns = vector_columns
+        self._path = path
+        self._result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write_batch(self, records: list[dict], vectors: dict) -> None:
+        for ix, record in enumerate(records):
+            vector_fields = {
+                column: vectors[column][ix].tolist() for column in self._vector_columns
+            }
+            self._result.append({**record, **vector_fields})
+
+    def close(self) -> None:
+        upload_inferences(result=self._result, task_id=self._task_id, path=self._path)
+
+
+def upload_inferences(result: list[dict], task_id: str, path: Optional[str] = None) -> None:
     """
     Uploads inferences to Google Cloud Storage.
 
     :param result: list of dict resulted from inference
     :param task_id: id for the run
+    :param path: destination blob, `tasks/<task_id>/inferences.json` by default
     :return: None
     """
     logger.info("Uploading metadata and images")
 
-    storage_client = storage.Client()
-    bucket = storage_client.get_bucket(BUCKET_NAME)
-    predictions_path = f"tasks/{task_id}/inferences.json"
-    blob = bucket.blob(predictions_path)
+    predictions_path = path or f"tasks/{task_id}/inferences.json"
     logger.info("Uploading inferences for task_id: %s", task_id)
-    blob.upload_from_string(json.dumps(result))
+    get_gateway().upload(BUCKET_NAME, predictions_path, json.dumps(result))
 
 
 def upload_blob_from_memory(
@@ -165,11 +556,9 @@ def upload_blob_from_memory(
     :param destination_blob_name: name of the destination blob name
     :param content_type: defines the content type
     """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
-
-    blob.upload_from_string(contents, content_type=content_type)
+    get_gateway().upload(
+        bucket_name, destination_blob_name, contents, content_type=content_type
+    )
 
 
 if __name__ == "__main__":
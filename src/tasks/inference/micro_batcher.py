@@ -0,0 +1,135 @@
+"""
+Dynamic micro-batching of synchronous predictions
+
+Requests handled concurrently by the worker threads submit their images to a single batcher, which
+runs them through the model together: a batch starts with the oldest queued image and takes the
+images that arrive within `max_delay` of it, up to `max_batch_size`. A lone request therefore waits
+at most `max_delay` more than it would alone, while concurrent requests share forward passes.
+
+The queue holds at most `max_queue` images. Requests that do not fit are rejected right away with
+`QueueFull` rather than piling up latency for everyone. Images whose future was cancelled while
+queued, e.g. by a request that timed out, are dropped instead of being predicted.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Sequence
+
+from common.metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+BATCH_SIZES = histogram(
+    "predict_batch_size", "Images per micro-batch", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+QUEUE_WAIT_SECONDS = histogram(
+    "predict_queue_wait_seconds", "Time images wait for their micro-batch"
+)
+REJECTED = counter("predict_rejected_images", "Images rejected because of a full queue")
+
+
+class QueueFull(Exception):
+    """Raised when the batcher queue has no room left for the submitted images."""
+
+
+class MicroBatcher:
+    """
+    Coalesces items submitted from many threads into batches for a single batch function.
+
+    :param predict: batch function, mapping a list of items to the list of their results
+    :param max_batch_size: most items per batch
+    :param max_delay: longest time, in seconds, a batch waits for more items after its first one
+    :param max_queue: most items waiting for a batch
+    """
+
+    def __init__(
+        self,
+        predict: Callable[[list], Sequence],
+        max_batch_size: int = 16,
+        max_delay: float = 0.005,
+        max_queue: int = 256,
+    ):
+        self._predict = predict
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._max_queue = max_queue
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, items: list) -> list[Future]:
+        """
+        Queues items, all of them or none, and returns the futures of their results.
+
+        :raises QueueFull: when the queue cannot take all the items
+        """
+        futures = [Future() for _ in items]
+        with self._condition:
+            if len(self._queue) + len(items) > self._max_queue:
+                REJECTED.inc(len(items))
+                raise QueueFull(
+                    f"{len(self._queue)} images are already waiting, at most {self._max_queue}"
+                )
+            self._ensure_thread()
+            now = time.perf_counter()
+            self._queue.extend((item, future, now) for item, future in zip(items, futures))
+            self._condition.notify()
+        return futures
+
+    def depth(self) -> int:
+        """Returns the number of items waiting for a batch."""
+        with self._condition:
+            return len(self._queue)
+
+    def _ensure_thread(self) -> None:
+        # threads do not survive forks, e.g. of gunicorn workers after a --preload import
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+            self._thread.start()
+
+    def _next_batch(self) -> list:
+        with self._condition:
+            while True:
+                while not self._queue:
+                    self._condition.wait()
+                deadline = self._queue[0][2] + self._max_delay
+                while len(self._queue) < self._max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = []
+                while self._queue and len(batch) < self._max_batch_size:
+                    entry = self._queue.popleft()
+                    # cancelled futures are dropped, the others can no longer be cancelled
+                    if entry[1].set_running_or_notify_cancel():
+                        batch.append(entry)
+                if batch:
+                    return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            start = time.perf_counter()
+            BATCH_SIZES.observe(len(batch))
+            for _, _, queued_at in batch:
+                QUEUE_WAIT_SECONDS.observe(start - queued_at)
+            try:
+                results = self._predict([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"{len(results)} results for a batch of {len(batch)} items")
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception("Batch of %d items failed", len(batch))
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
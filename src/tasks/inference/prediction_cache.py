@@ -0,0 +1,252 @@
+"""
+Content-addressed cache of model predictions
+
+Predictions are keyed by the sha256 of the image bytes, the version of the model, the
+fingerprint of its weights (see `registry.model_fingerprint`), and the version of the
+preprocessing, so an image already scored with the same weights and preprocessing never goes
+through the forward pass again, whatever task or name it comes with.
+
+Entries are `.npz` files with one array per output column, kept on the local disk under
+`<root>/<key version>/<hash[:2]>/<hash>.npz` and evicted in least recently used order once they
+take more than `max_bytes`, `<key version>` being `<model version>-<preprocessing version>`.
+With a bucket, entries are also shared through object storage, under
+`<prefix>/<key version>/<hash>.npz`, which outlives the instance and its disk but is never
+evicted: callers only share the predictions of models whose version outlives the process.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from common.metrics import counter
+from common.storage import get_gateway, is_not_found
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# an empty directory disables the cache
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR", "/tmp/prediction-cache")
+PREDICTION_CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", 1024**3))
+# optional object storage tier, shared by every worker instance, off by default since it has no
+# eviction
+PREDICTION_CACHE_BUCKET = os.getenv("PREDICTION_CACHE_BUCKET", "")
+PREDICTION_CACHE_PREFIX = os.getenv("PREDICTION_CACHE_PREFIX", "prediction-cache")
+PREDICTION_CACHE_CONCURRENCY = int(os.getenv("PREDICTION_CACHE_CONCURRENCY", 16))
+ENTRY_SUFFIX = ".npz"
+
+LOOKUPS = counter(
+    "prediction_cache_lookups", "Prediction cache lookups, per tier that answered", ["result"]
+)
+
+
+def content_hash(image_bytes: bytes) -> str:
+    """Returns the key of an image in the cache, the sha256 of its bytes."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier prediction cache: the local disk, then optionally a bucket.
+
+    :param root: directory of the local tier
+    :param max_bytes: size of the local tier, beyond which least recently used entries are evicted
+    :param bucket_name: bucket of the object storage tier, none when empty
+    :param prefix: prefix of the entries in the bucket
+    :param gateway: storage gateway, the process-wide one by default
+    :param concurrency: concurrent requests to the object storage tier
+    :param preprocessing: version of the preprocessing the predictions were made after
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = PREDICTION_CACHE_MAX_BYTES,
+        bucket_name: str = "",
+        prefix: str = PREDICTION_CACHE_PREFIX,
+        gateway=None,
+        concurrency: int = PREDICTION_CACHE_CONCURRENCY,
+        preprocessing: str = "",
+    ):
+        self._root = Path(root)
+        self._max_bytes = max_bytes
+        self._bucket_name = bucket_name
+        self._prefix = prefix.rstrip("/")
+        self._gateway = gateway
+        self._preprocessing = preprocessing
+        self._executor = ThreadPoolExecutor(max_workers=concurrency) if bucket_name else None
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Path, int] = OrderedDict()
+        self._nbytes = 0
+        self._scan()
+
+    @property
+    def gateway(self):
+        return self._gateway or get_gateway()
+
+    def nbytes(self) -> int:
+        """Returns the size of the local tier."""
+        with self._lock:
+            return self._nbytes
+
+    def get_many(self, version: str, hashes: Iterable[str], shared: bool = True) -> dict[str, dict]:
+        """
+        Looks up the predictions of many images made by a model version.
+
+        :param version: model version
+        :param hashes: content hashes of the images
+        :param shared: whether to also look in the object storage tier
+        :return: arrays of every output column, per hash found
+        """
+        found, missing = {}, []
+        for image_hash in dict.fromkeys(hashes):
+            entry = self._read_local(version, image_hash)
+            if entry is not None:
+                found[image_hash] = entry
+            else:
+                missing.append(image_hash)
+        LOOKUPS.labels(result="local").inc(len(found))
+
+        if missing and shared and self._executor is not None:
+            remote = self._executor.map(
+                lambda image_hash: self._read_remote(version, image_hash), missing
+            )
+            for image_hash, contents in zip(missing, list(remote)):
+                if contents is not None:
+                    self._write_local(version, image_hash, contents)
+                    found[image_hash] = decode_entry(contents)
+                    LOOKUPS.labels(result="remote").inc()
+        LOOKUPS.labels(result="miss").inc(len([h for h in missing if h not in found]))
+        return found
+
+    def put_many(self, version: str, predictions: dict[str, dict], shared: bool = True) -> None:
+        """
+        Stores the predictions of many images made by a model version.
+
+        :param version: model version
+        :param predictions: arrays of every output column, per content hash
+        :param shared: whether to also store them in the object storage tier, which should only
+            hold the predictions of models whose version outlives the process
+        """
+        entries = {image_hash: encode_entry(arrays) for image_hash, arrays in predictions.items()}
+        for image_hash, contents in entries.items():
+            self._write_local(version, image_hash, contents)
+        if shared and self._executor is not None:
+            # the object storage tier only saves work, it must not fail the task
+            list(
+                self._executor.map(
+                    lambda item: self._write_remote(version, *item), entries.items()
+                )
+            )
+
+    def _key_version(self, version: str) -> str:
+        return f"{version}-{self._preprocessing}" if self._preprocessing else version
+
+    def _path(self, version: str, image_hash: str) -> Path:
+        key_version = self._key_version(version)
+        return self._root / key_version / image_hash[:2] / f"{image_hash}{ENTRY_SUFFIX}"
+
+    def _blob_name(self, version: str, image_hash: str) -> str:
+        return f"{self._prefix}/{self._key_version(version)}/{image_hash}{ENTRY_SUFFIX}"
+
+    def _scan(self) -> None:
+        """Indexes the entries already on disk, from the least recently used."""
+        paths = []
+        if self._root.exists():
+            for path in self._root.rglob(f"*{ENTRY_SUFFIX}"):
+                stat = path.stat()
+                paths.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(paths):
+            self._entries[path] = size
+            self._nbytes += size
+        if paths:
+            logger.info("Found %d cached predictions (%d bytes)", len(paths), self._nbytes)
+        self._evict()
+
+    def _read_local(self, version: str, image_hash: str) -> Optional[dict]:
+        path = self._path(version, image_hash)
+        with self._lock:
+            if path not in self._entries:
+                return None
+            self._entries.move_to_end(path)
+        try:
+            contents = path.read_bytes()
+            # the modification time orders entries by last use after a restart
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(path)
+            return None
+        return decode_entry(contents)
+
+    def _write_local(self, version: str, image_hash: str, contents: bytes) -> None:
+        path = self._path(version, image_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(contents)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._nbytes += len(contents) - self._entries.pop(path, 0)
+            self._entries[path] = len(contents)
+            self._evict()
+
+    def _forget(self, path: Path) -> None:
+        with self._lock:
+            self._nbytes -= self._entries.pop(path, 0)
+
+    def _evict(self) -> None:
+        while self._nbytes > self._max_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._nbytes -= size
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _read_remote(self, version: str, image_hash: str) -> Optional[bytes]:
+        try:
+            return self.gateway.download(self._bucket_name, self._blob_name(version, image_hash))
+        except Exception as error:  # pylint: disable=broad-except
+            if not is_not_found(error):
+                logger.warning("Could not read cached prediction %s: %r", image_hash, error)
+            return None
+
+    def _write_remote(self, version: str, image_hash: str, contents: bytes) -> None:
+        try:
+            self.gateway.upload(self._bucket_name, self._blob_name(version, image_hash), contents)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not store cached prediction %s", image_hash)
+
+
+def encode_entry(arrays: dict) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_entry(contents: bytes) -> dict:
+    with np.load(io.BytesIO(contents)) as entry:
+        return {column: entry[column] for column in entry.files}
+
+
+def load_prediction_cache(preprocessing: str = "") -> Optional[PredictionCache]:
+    """
+    Creates the cache configured through the environment, or returns None if it is disabled.
+
+    :param preprocessing: version of the preprocessing the predictions are made after
+    """
+    if not PREDICTION_CACHE_DIR:
+        return None
+    return PredictionCache(
+        PREDICTION_CACHE_DIR,
+        max_bytes=PREDICTION_CACHE_MAX_BYTES,
+        bucket_name=PREDICTION_CACHE_BUCKET,
+        preprocessing=preprocessing,
+    )
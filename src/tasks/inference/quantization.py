@@ -0,0 +1,121 @@
+"""
+Reduced precision variants of the inference models
+
+`int8` quantizes the weights of every Linear layer to int8 and quantizes their activations on the
+fly, batch by batch. The fully connected layers hold most of the weights of FashionNetVgg16NoBn,
+so this cuts its memory by about 4x, while the conv stacks keep running in float32.
+
+Compare a quantized model against its float version on the images of an imagery run with:
+
+    python quantization.py <task_id> [--model-uri default] [--output report.json]
+"""
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import logging
+import time
+from typing import Iterable
+
+import torch
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+FLOAT32 = "float32"
+INT8 = "int8"
+PRECISIONS = (FLOAT32, INT8)
+
+
+def quantize(model: torch.nn.Module, precision: str) -> torch.nn.Module:
+    """
+    Returns `model` at the given precision.
+
+    :param model: float model, left untouched
+    :param precision: one of `PRECISIONS`
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+    if precision == FLOAT32:
+        return model
+    model = copy.deepcopy(model).eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def parity_report(
+    reference: torch.nn.Module, candidate: torch.nn.Module, batches: Iterable[torch.Tensor]
+) -> dict:
+    """
+    Compares the outputs of two models returning `(massive_attr, categories)` on the same images.
+
+    :param reference: float model
+    :param candidate: model to validate, e.g. its quantized version
+    :param batches: float image batches
+    :return: agreement of the predicted categories, output errors and latencies
+    """
+    from registry import model_nbytes  # pylint: disable=import-outside-toplevel
+
+    images = agreements = 0
+    max_error = {"massive_attr": 0.0, "categories": 0.0}
+    error_sum = {"massive_attr": 0.0, "categories": 0.0}
+    latency = {"reference": 0.0, "candidate": 0.0}
+    with torch.no_grad():
+        for batch in batches:
+            outputs = {}
+            for name, model in (("reference", reference), ("candidate", candidate)):
+                start = time.perf_counter()
+                outputs[name] = model(batch)
+                latency[name] += time.perf_counter() - start
+
+            for ix, column in enumerate(max_error):
+                error = (outputs["reference"][ix] - outputs["candidate"][ix]).abs()
+                max_error[column] = max(max_error[column], error.max().item())
+                error_sum[column] += error.mean(dim=1).sum().item()
+            agreements += (
+                (outputs["reference"][1].argmax(dim=1) == outputs["candidate"][1].argmax(dim=1))
+                .sum()
+                .item()
+            )
+            images += batch.size(0)
+
+    images = max(images, 1)
+    return {
+        "images": images,
+        "category_agreement": agreements / images,
+        "max_abs_error": max_error,
+        "mean_abs_error": {column: total / images for column, total in error_sum.items()},
+        "seconds_per_image": {name: total / images for name, total in latency.items()},
+        "nbytes": {"reference": model_nbytes(reference), "candidate": model_nbytes(candidate)},
+    }
+
+
+if __name__ == "__main__":
+    # pylint: disable=import-outside-toplevel
+    from torch.utils.data import DataLoader
+
+    from main import BUCKET_NAME, list_blobs_with_prefix
+    from registry import DEFAULT_MODEL_URI, load_model
+    from utils.dataset import ImagesDataset, to_float
+
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Compares an int8 model with its float version")
+    parser.add_argument("task_id", help="imagery run whose images are compared on")
+    parser.add_argument("--model-uri", default=DEFAULT_MODEL_URI)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--output", help="also write the report into this file")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    float_model = load_model(args.model_uri).eval()
+    int8_model = quantize(float_model, INT8)
+    images_filepaths = list_blobs_with_prefix(BUCKET_NAME, f"tasks/{args.task_id}/", [])
+    loader = DataLoader(ImagesDataset(images_filepaths), batch_size=args.batch_size)
+    report = parity_report(
+        float_model, int8_model, (to_float(images) for images, *_ in loader)
+    )
+    report.update(task_id=args.task_id, model_uri=args.model_uri)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
@@ -0,0 +1,205 @@
+"""Process-wide registry of inference models"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import torch
+
+from deepfashion import FashionNetVgg16NoBn
+from export import ARTIFACT_SUFFIX, EAGER, compile_model, load_artifact
+from quantization import FLOAT32, quantize
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_MODEL_URI = "default"
+
+
+def build_default_model() -> torch.nn.Module:
+    """Builds FashionNetVgg16NoBn with xavier initialised conv5 weights."""
+    fn = FashionNetVgg16NoBn()
+
+    for k in fn.state_dict().keys():
+        if "conv5_pose" in k and "weight" in k:
+            torch.nn.init.xavier_normal_(fn.state_dict()[k])
+
+    for k in fn.state_dict().keys():
+        if "conv5_global" in k and "weight" in k:
+            torch.nn.init.xavier_normal_(fn.state_dict()[k])
+
+    return fn
+
+
+def load_model(
+    model_uri: str, precision: str = FLOAT32, runtime: str = EAGER
+) -> torch.nn.Module:
+    """
+    Loads a model given its uri.
+
+    :param model_uri: `default` for the freshly initialised network, a TorchScript artifact
+        exported by `export.py` (a local path or an artifact uri ending with `.pt`), otherwise any
+        uri accepted by `mlflow.pytorch.load_model` (e.g. `models:/fashionnet/3` or
+        `runs:/<run_id>/model`)
+    :param precision: precision the model runs at, see `quantization.PRECISIONS`
+    :param runtime: runtime the model is served with, see `export.RUNTIMES`
+    """
+    if model_uri.endswith(ARTIFACT_SUFFIX):
+        return load_exported_model(model_uri)
+
+    if model_uri == DEFAULT_MODEL_URI:
+        model = build_default_model()
+    else:
+        import mlflow.pytorch  # pylint: disable=import-outside-toplevel
+
+        model = mlflow.pytorch.load_model(model_uri, map_location="cpu")
+
+    return compile_model(quantize(model.eval(), precision), runtime)
+
+
+def load_exported_model(artifact_uri: str) -> torch.jit.ScriptModule:
+    """Loads a model exported by `export.py`, already compiled at its own precision."""
+    path = artifact_uri
+    if not os.path.exists(path):
+        import mlflow.artifacts  # pylint: disable=import-outside-toplevel
+
+        path = mlflow.artifacts.download_artifacts(artifact_uri=artifact_uri)
+    return load_artifact(path)
+
+
+def _tensors(value):
+    if isinstance(value, torch.Tensor):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _tensors(item)
+    elif isinstance(value, torch.ScriptObject):
+        yield from torch.ops.quantized.linear_unpack(value)
+
+
+def _constants(model: torch.jit.ScriptModule):
+    for node in model.graph.findAllNodes("prim::Constant"):
+        output_type = node.output().type()
+        if not node.hasAttribute("value"):
+            continue
+        if output_type.kind() == "TensorType" or "LinearPackedParams" in output_type.str():
+            yield node.output().toIValue()
+
+
+def model_nbytes(model: torch.nn.Module) -> int:
+    """
+    Returns the memory held by the state of a model.
+
+    Quantized layers keep their packed weights outside of their parameters, so the state dict is
+    measured rather than the parameters and buffers. Frozen TorchScript models have no state left,
+    their weights being constants of the graph.
+    """
+    storages = {t.data_ptr(): t.numel() * t.element_size() for t in _state_tensors(model)}
+    return sum(storages.values())
+
+
+def model_fingerprint(model: torch.nn.Module) -> str:
+    """
+    Returns a digest of the weights of a model, which versions its predictions.
+
+    Unlike the model uri, it changes whenever the weights do, e.g. for `default` models that are
+    initialised randomly, or uris such as `models:/fashionnet/Production` moving to a new version.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(type(model).__name__.encode("utf-8"))
+    for tensor in _state_tensors(model):
+        tensor = tensor.detach()
+        if tensor.is_quantized:
+            tensor = tensor.dequantize()
+        digest.update(str(tuple(tensor.shape)).encode("utf-8"))
+        digest.update(tensor.contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _state_tensors(model: torch.nn.Module) -> list[torch.Tensor]:
+    values = list(model.state_dict(keep_vars=True).values())
+    if isinstance(model, torch.jit.ScriptModule) and hasattr(model, "graph"):
+        values.extend(_constants(model))
+    return [tensor for value in values for tensor in _tensors(value)]
+
+
+class ModelRegistry:
+    """
+    Keeps models warm across requests, keyed by model uri.
+
+    Models are loaded once, switched to eval mode and evicted in least recently used order
+    once the memory they hold goes over `max_bytes`. The most recently used model is always kept,
+    even if it alone is bigger than the cap. Each model is fingerprinted when it is loaded, see
+    `model_fingerprint`.
+    """
+
+    def __init__(self, max_bytes: int, loader: Callable[[str], torch.nn.Module] = load_model):
+        self._max_bytes = max_bytes
+        self._loader = loader
+        self._models: OrderedDict[str, tuple[torch.nn.Module, int, str]] = OrderedDict()
+        self._loading: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_uri: str) -> torch.nn.Module:
+        """
+        Returns the model for `model_uri`, loading it on first use.
+
+        Concurrent requests for a model that is still loading wait for that load instead of
+        starting their own.
+        """
+        return self.get_versioned(model_uri)[0]
+
+    def get_versioned(self, model_uri: str) -> tuple[torch.nn.Module, str]:
+        """Returns the model for `model_uri` along with its fingerprint, loading it on first use."""
+        with self._lock:
+            entry = self._lookup(model_uri)
+            if entry is not None:
+                return entry
+            load_lock = self._loading.setdefault(model_uri, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._lookup(model_uri)
+                if entry is not None:
+                    return entry
+
+            logger.info("Loading model %s", model_uri)
+            model = self._loader(model_uri)
+            model.eval()
+            nbytes = model_nbytes(model)
+            version = model_fingerprint(model)
+            logger.info("Loaded model %s, version %s", model_uri, version)
+
+            with self._lock:
+                self._models[model_uri] = (model, nbytes, version)
+                self._loading.pop(model_uri, None)
+                self._evict()
+            return model, version
+
+    def __contains__(self, model_uri: str) -> bool:
+        with self._lock:
+            return model_uri in self._models
+
+    def nbytes(self) -> int:
+        """Returns the memory held by all the cached models."""
+        with self._lock:
+            return sum(nbytes for _, nbytes, _ in self._models.values())
+
+    def _lookup(self, model_uri):
+        entry = self._models.get(model_uri)
+        if entry is None:
+            return None
+        self._models.move_to_end(model_uri)
+        model, _, version = entry
+        return model, version
+
+    def _evict(self):
+        total = sum(nbytes for _, nbytes, _ in self._models.values())
+        while total > self._max_bytes and len(self._models) > 1:
+            model_uri, (_, nbytes, _) = self._models.popitem(last=False)
+            total -= nbytes
+            logger.info("Evicted model %s (%d bytes)", model_uri, nbytes)
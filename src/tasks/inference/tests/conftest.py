@@ -0,0 +1,17 @@
+"""Create pytest fixtures"""
+import os
+import sys
+
+import pytest
+import torch
+
+WORKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The worker is deployed with its own directory as the import root, next to a copy of src/common
+sys.path.insert(0, os.path.dirname(os.path.dirname(WORKER_DIR)))
+sys.path.insert(0, WORKER_DIR)
+
+
+@pytest.fixture(autouse=True)
+def seed():
+    torch.manual_seed(0)
@@ -0,0 +1,60 @@
+"""Unit tests for the background artifact logger"""
+import threading
+from pathlib import Path
+
+import pytest
+
+from utils import artifacts
+from utils.artifacts import ArtifactLogger
+
+
+class RecordingClient:
+    """Records the artifacts logged to MLflow and the thread logging them."""
+
+    def __init__(self):
+        self.uploads = []
+
+    def log_artifacts(self, run_id, local_dir):
+        files = sorted(
+            path.relative_to(local_dir).as_posix()
+            for path in Path(local_dir).rglob("*")
+            if path.is_file()
+        )
+        self.uploads.append((run_id, threading.current_thread(), files))
+
+
+class FailingClient:
+    def log_artifacts(self, run_id, local_dir):
+        raise ConnectionError("tracking server unavailable")
+
+
+def test_artifacts_are_uploaded_off_the_calling_thread(monkeypatch):
+    """Artifacts should reach MLflow in chunks, from the background thread"""
+    client = RecordingClient()
+    monkeypatch.setattr(artifacts, "MlflowClient", lambda: client)
+
+    with ArtifactLogger("run", chunk_size=2, max_pending=1) as artifact_logger:
+        for name in "abc":
+            artifact_logger.log_image_bytes(b"jpeg", f"images/{name}.jpg")
+            artifact_logger.log_dict({"name": name}, f"inferences/{name}.json")
+
+    assert [files for _, _, files in client.uploads] == [
+        ["images/a.jpg", "images/b.jpg", "inferences/a.json"],
+        ["images/c.jpg", "inferences/b.json", "inferences/c.json"],
+    ]
+    assert {run_id for run_id, _, _ in client.uploads} == {"run"}
+    assert threading.current_thread() not in {thread for _, thread, _ in client.uploads}
+
+
+def test_upload_errors_do_not_replace_the_error_of_the_block(monkeypatch):
+    """A failing upload is raised on a clean exit, but never hides the error being raised"""
+    monkeypatch.setattr(artifacts, "MlflowClient", FailingClient)
+
+    with pytest.raises(ConnectionError):
+        with ArtifactLogger("run") as artifact_logger:
+            artifact_logger.log_dict({}, "inferences/a.json")
+
+    with pytest.raises(ValueError):
+        with ArtifactLogger("run") as artifact_logger:
+            artifact_logger.log_dict({}, "inferences/a.json")
+            raise ValueError("no images")
@@ -0,0 +1,43 @@
+"""Unit tests for the inference data loading options"""
+import pytest
+
+from utils.dataset import dataloader_options
+
+DEFAULTS = {"batch_size": 16, "num_workers": 4, "prefetch_factor": 2}
+LIMITS = {"batch_size": (1, 64), "num_workers": (0, 8), "prefetch_factor": (1, 4)}
+
+
+def test_payload_options_override_the_worker_defaults():
+    options = dataloader_options({"batch_size": 32, "num_workers": None}, DEFAULTS, LIMITS)
+
+    assert options == {"batch_size": 32, "num_workers": 4, "prefetch_factor": 2}
+
+
+def test_options_above_their_limit_are_clamped():
+    payload = {"batch_size": 10000, "num_workers": 64, "prefetch_factor": 100}
+
+    options = dataloader_options(payload, DEFAULTS, LIMITS)
+
+    assert options == {"batch_size": 64, "num_workers": 8, "prefetch_factor": 4}
+
+
+def test_prefetching_is_dropped_without_worker_processes():
+    options = dataloader_options({"num_workers": 0, "prefetch_factor": 3}, DEFAULTS, LIMITS)
+
+    assert options == {"batch_size": 16, "num_workers": 0}
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"batch_size": 0},
+        {"num_workers": -1},
+        {"prefetch_factor": 0},
+        {"batch_size": "16"},
+        {"batch_size": 2.5},
+        {"num_workers": True},
+    ],
+)
+def test_invalid_options_are_rejected(payload):
+    with pytest.raises(ValueError):
+        dataloader_options(payload, DEFAULTS, LIMITS)
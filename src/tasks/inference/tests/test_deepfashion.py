@@ -0,0 +1,113 @@
+"""Unit tests for FashionNetVgg16NoBn helpers"""
+import copy
+
+import torch
+from torch.nn import AdaptiveMaxPool2d
+
+from deepfashion import (
+    N_LANDMARKS,
+    ROI_POOL_SIZE,
+    FashionNetVgg16NoBn,
+    gated_roi_pooling,
+    landmark_predictions_to_roipool_boxes,
+)
+
+
+def loop_roi_pooling(input, rois, gates=None, size=ROI_POOL_SIZE):
+    """Per-roi reference implementation the batched pooling must match"""
+    output = []
+    rois = rois.clone().long()
+    for roi in rois:
+        im = input.narrow(0, roi[0], 1)[..., roi[2] : (roi[4] + 1), roi[1] : (roi[3] + 1)]
+        output.append(AdaptiveMaxPool2d(size)(im))
+    pooled_features = torch.cat(output, 0)
+    if gates is not None:
+        pooled_features[gates.flatten()] = 0
+    return pooled_features.view(input.shape[0], -1, size[0], size[1])
+
+
+def random_rois(batch_size, height, width):
+    batch_ix = torch.arange(batch_size).repeat_interleave(N_LANDMARKS)
+    x1 = torch.randint(0, width, (batch_size * N_LANDMARKS,))
+    y1 = torch.randint(0, height, (batch_size * N_LANDMARKS,))
+    x2 = x1 + torch.randint(0, 9, x1.shape)
+    y2 = y1 + torch.randint(0, 9, y1.shape)
+    return torch.stack([batch_ix, x1, y1, x2, y2], dim=1).float()
+
+
+def test_gated_roi_pooling_matches_loop():
+    """Batched pooling should match the per-roi loop, including boxes past the border"""
+    features = torch.relu(torch.randn(4, 16, 28, 28))
+    rois = random_rois(4, 28, 28)
+    gates = torch.rand(4, N_LANDMARKS) < 0.3
+
+    expected = loop_roi_pooling(features, rois, gates)
+    pooled = gated_roi_pooling(features, rois, gates)
+
+    assert pooled.shape == (4, 16 * N_LANDMARKS, *ROI_POOL_SIZE)
+    assert torch.equal(pooled, expected)
+
+
+def test_gated_roi_pooling_does_not_mutate_rois():
+    """Scaling the boxes should not write back into the caller's tensor"""
+    features = torch.relu(torch.randn(1, 4, 28, 28))
+    rois = random_rois(1, 14, 14)
+    original = rois.clone()
+
+    gated_roi_pooling(features, rois, spatial_scale=2.0)
+
+    assert torch.equal(rois, original)
+
+
+def test_roipool_boxes_match_single_sample_loop():
+    """Boxes for a single sample should match the original per-landmark construction"""
+    landmark_loc = torch.randn(1, 2 * N_LANDMARKS) * 200
+    expected = []
+    for x, y in landmark_loc.reshape(-1, 2):
+        x, y = int(x / 16), int(y / 16)
+        expected.append(torch.Tensor([0, x - 3, y - 3, x + 3, y + 3]).clamp(min=0))
+
+    boxes = landmark_predictions_to_roipool_boxes(landmark_loc, bbs=3)
+
+    assert torch.equal(boxes, torch.stack(expected))
+
+
+def test_roipool_boxes_tag_every_sample():
+    """Each sample's landmarks should point at their own feature map"""
+    boxes = landmark_predictions_to_roipool_boxes(torch.rand(3, 2 * N_LANDMARKS) * 224)
+
+    assert boxes.shape == (3 * N_LANDMARKS, 5)
+    assert boxes[:, 0].tolist() == [i for i in range(3) for _ in range(N_LANDMARKS)]
+
+
+def test_forward_is_batch_independent():
+    """A batch should produce the same predictions as its samples run one by one"""
+    model = FashionNetVgg16NoBn().eval()
+    images = torch.rand(2, 3, 224, 224)
+
+    with torch.no_grad():
+        batched = model(images)
+        single = [model(image.unsqueeze(0)) for image in images]
+
+    for ix, output in enumerate(batched):
+        expected = torch.cat([outputs[ix] for outputs in single])
+        assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_tied_conv5_runs_once_with_identical_outputs():
+    """Tied conv5 branches should share one pass, untied ones keep their own, same state dict"""
+    model = FashionNetVgg16NoBn().eval()
+    untied = FashionNetVgg16NoBn().eval()
+    untied.conv5_global = copy.deepcopy(untied.conv5_global)
+    untied.load_state_dict(model.state_dict())
+    images = torch.rand(2, 3, 224, 224) * 255
+
+    with torch.no_grad():
+        shared_outputs = model(images)
+        untied_outputs = untied(images)
+
+    assert model.conv5_is_shared()
+    assert not untied.conv5_is_shared()
+    assert list(untied.state_dict()) == list(model.state_dict())
+    for shared, separate in zip(shared_outputs, untied_outputs):
+        assert torch.equal(shared, separate)
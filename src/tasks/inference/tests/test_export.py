@@ -0,0 +1,31 @@
+"""Parity tests for the TorchScript runtime"""
+import torch
+
+from export import EAGER, TORCHSCRIPT, compile_model, freeze, parity
+from quantization import INT8, quantize
+from registry import build_default_model, load_model, model_nbytes
+
+
+def test_torchscript_matches_eager_model():
+    """The compiled model, roi pooling included, should give the eager outputs"""
+    model = build_default_model().eval()
+    images = torch.rand(2, 3, 224, 224) * 255
+
+    compiled = compile_model(model, TORCHSCRIPT)
+
+    assert compile_model(model, EAGER) is model
+    assert isinstance(compiled, torch.jit.ScriptModule)
+    assert max(parity(model, compiled, images)) < 1e-4
+
+
+def test_exported_artifacts_are_served_as_is(tmp_path):
+    """Saved artifacts should load back through the registry loader with their weights counted"""
+    model = torch.nn.Sequential(torch.nn.Linear(32, 32), torch.nn.ReLU()).eval()
+    for name, exported in (("float32", model), ("int8", quantize(model, INT8))):
+        path = str(tmp_path / f"{name}.pt")
+        torch.jit.save(freeze(exported), path)
+
+        loaded = load_model(path)
+
+        assert max(parity(exported, loaded, torch.randn(4, 32))) < 1e-5
+        assert model_nbytes(loaded) >= 0.95 * model_nbytes(exported)
@@ -0,0 +1,98 @@
+"""Unit tests for the micro-batcher"""
+import threading
+
+import pytest
+
+from micro_batcher import MicroBatcher, QueueFull
+
+
+def test_concurrent_items_share_batches():
+    """Items submitted within the delay of each other should run in one batch, in order"""
+    batches = []
+    batcher = MicroBatcher(
+        lambda items: batches.append(items) or [item * 2 for item in items],
+        max_batch_size=4,
+        max_delay=0.5,
+    )
+
+    futures = batcher.submit([1, 2, 3]) + batcher.submit([4, 5])
+
+    assert [future.result(timeout=5) for future in futures] == [2, 4, 6, 8, 10]
+    assert batches == [[1, 2, 3, 4], [5]]
+
+
+def test_lone_items_do_not_wait_for_a_full_batch():
+    batcher = MicroBatcher(lambda items: items, max_batch_size=64, max_delay=0.01)
+
+    assert batcher.submit(["image"])[0].result(timeout=1) == "image"
+
+
+def test_full_queue_rejects_whole_requests():
+    """Items over the queue size should be rejected, without queuing part of the request"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def predict(items):
+        started.set()
+        release.wait(5)
+        return items
+
+    batcher = MicroBatcher(predict, max_batch_size=1, max_delay=0, max_queue=2)
+    running = batcher.submit(["running"])
+    assert started.wait(5)
+    queued = batcher.submit(["a", "b"])
+
+    with pytest.raises(QueueFull):
+        batcher.submit(["c"])
+    assert batcher.depth() == 2
+
+    release.set()
+    assert [future.result(timeout=5) for future in running + queued] == ["running", "a", "b"]
+
+
+def test_batch_failures_reach_every_caller_of_the_batch():
+    def predict(items):
+        raise RuntimeError("out of memory")
+
+    batcher = MicroBatcher(predict, max_batch_size=2, max_delay=0.5)
+
+    for future in batcher.submit(["a", "b"]):
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    with pytest.raises(RuntimeError):
+        batcher.submit(["c"])[0].result(timeout=5)
+
+
+def test_batches_with_missing_results_fail_every_item():
+    """A batch function returning too few results should fail the batch rather than hang it"""
+    batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=2, max_delay=0.5)
+
+    for future in batcher.submit(["a", "b"]):
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+
+
+def test_cancelled_items_are_not_predicted():
+    """Items cancelled while queued, e.g. after a request timed out, should be dropped"""
+    release = threading.Event()
+    started = threading.Event()
+    batches = []
+
+    def predict(items):
+        started.set()
+        release.wait(5)
+        batches.append(items)
+        return items
+
+    batcher = MicroBatcher(predict, max_batch_size=4, max_delay=0)
+    running = batcher.submit(["running"])
+    assert started.wait(5)
+    cancelled = batcher.submit(["a", "b"])
+    kept = batcher.submit(["c"])
+
+    assert all(future.cancel() for future in cancelled)
+    assert not running[0].cancel()
+    release.set()
+
+    assert kept[0].result(timeout=5) == "c"
+    assert batches == [["running"], ["c"]]
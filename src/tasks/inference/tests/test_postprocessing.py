@@ -0,0 +1,45 @@
+"""Unit tests for the batch postprocessing"""
+import numpy as np
+
+from utils.categories_mapping import master_categories
+from utils.postprocessing import postprocess
+
+
+def batch_outputs(rows=4):
+    rng = np.random.default_rng(0)
+    return {
+        "massive_attr": rng.random((rows, 1000), dtype=np.float32),
+        "categories": rng.random((rows, len(master_categories)), dtype=np.float32),
+    }
+
+
+def test_best_category_matches_per_image_lookup():
+    """The batch argmax should pick the category the per-image max/index lookup did"""
+    vectors = batch_outputs()
+    vectors["categories"][0, [3, 7]] = 2.0
+
+    fields = postprocess(vectors)
+
+    for row, categories in zip(fields, vectors["categories"].tolist()):
+        index = categories.index(max(categories))
+        assert row == {
+            "category_prediction_index": index,
+            "category_prediction": master_categories[index],
+        }
+    assert fields[0]["category_prediction_index"] == 3
+
+
+def test_top_k_reports_best_categories_and_attributes_first():
+    vectors = batch_outputs()
+
+    fields = postprocess(vectors, top_k=3)
+
+    for row, categories, attributes in zip(
+        fields, vectors["categories"], vectors["massive_attr"]
+    ):
+        assert row["top_category_indices"] == np.argsort(-categories)[:3].tolist()
+        assert row["top_category_indices"][0] == row["category_prediction_index"]
+        assert row["top_categories"] == [master_categories[i] for i in row["top_category_indices"]]
+        np.testing.assert_allclose(row["top_category_scores"], np.sort(categories)[::-1][:3])
+        assert row["top_attribute_indices"] == np.argsort(-attributes)[:3].tolist()
+        assert len(row["top_attribute_scores"]) == 3
@@ -0,0 +1,71 @@
+"""Unit tests for the prediction cache"""
+import numpy as np
+
+from common.storage import LocalGateway
+from prediction_cache import PredictionCache, content_hash
+
+
+def prediction(value):
+    return {
+        "massive_attr": np.full(1000, value, dtype=np.float32),
+        "categories": np.full(50, value, dtype=np.float32),
+    }
+
+
+def test_cache_is_keyed_by_content_model_and_preprocessing_versions(tmp_path):
+    """Predictions come back for the same image bytes, model and preprocessing versions only"""
+    cache = PredictionCache(str(tmp_path))
+    image_hash = content_hash(b"image")
+
+    cache.put_many("v1", {image_hash: prediction(1.0)})
+
+    found = cache.get_many("v1", [image_hash, content_hash(b"other image")])
+    assert list(found) == [image_hash]
+    np.testing.assert_array_equal(found[image_hash]["categories"], prediction(1.0)["categories"])
+    assert found[image_hash]["massive_attr"].dtype == np.float32
+    assert cache.get_many("v2", [image_hash]) == {}
+    assert image_hash in PredictionCache(str(tmp_path)).get_many("v1", [image_hash])
+    assert PredictionCache(str(tmp_path), preprocessing="p2").get_many("v1", [image_hash]) == {}
+
+
+def test_cache_evicts_least_recently_used_entries(tmp_path):
+    """Going over the size cap drops the entries used longest ago, on disk too"""
+    hashes = [content_hash(bytes([i])) for i in range(3)]
+    cache = PredictionCache(str(tmp_path), max_bytes=10**9)
+    cache.put_many("v1", {hashes[0]: prediction(0.0), hashes[1]: prediction(1.0)})
+    entry_size = cache.nbytes() // 2
+    cache = PredictionCache(str(tmp_path), max_bytes=2 * entry_size)
+
+    cache.get_many("v1", [hashes[0]])
+    cache.put_many("v1", {hashes[2]: prediction(2.0)})
+
+    assert set(cache.get_many("v1", hashes)) == {hashes[0], hashes[2]}
+    assert cache.nbytes() == 2 * entry_size
+    assert len(list(tmp_path.rglob("*.npz"))) == 2
+
+
+def test_object_storage_tier_is_shared_between_instances(tmp_path):
+    """An entry stored by one worker instance is found by another one with an empty disk"""
+    gateway = LocalGateway(str(tmp_path / "storage"))
+    image_hash = content_hash(b"image")
+    PredictionCache(str(tmp_path / "a"), bucket_name="bucket", gateway=gateway).put_many(
+        "v1", {image_hash: prediction(1.0)}
+    )
+
+    cache = PredictionCache(str(tmp_path / "b"), bucket_name="bucket", gateway=gateway)
+
+    assert image_hash in cache.get_many("v1", [image_hash])
+    assert cache.nbytes() > 0
+    assert cache.get_many("v2", [image_hash]) == {}
+
+
+def test_unshared_predictions_stay_off_object_storage(tmp_path):
+    """Predictions of models whose version does not outlive the process stay on the local disk"""
+    gateway = LocalGateway(str(tmp_path / "storage"))
+    image_hash = content_hash(b"image")
+    cache = PredictionCache(str(tmp_path / "a"), bucket_name="bucket", gateway=gateway)
+
+    cache.put_many("v1", {image_hash: prediction(1.0)}, shared=False)
+
+    assert gateway.list("bucket", "") == []
+    assert image_hash in cache.get_many("v1", [image_hash], shared=False)
@@ -0,0 +1,42 @@
+"""Unit tests for the quantized inference mode"""
+import pytest
+import torch
+
+from quantization import FLOAT32, INT8, parity_report, quantize
+from registry import model_nbytes
+
+
+class TwoHeads(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.trunk = torch.nn.Linear(64, 256)
+        self.massive_attr = torch.nn.Linear(256, 32)
+        self.categories = torch.nn.Linear(256, 8)
+
+    def forward(self, x):
+        features = torch.relu(self.trunk(x))
+        return torch.sigmoid(self.massive_attr(features)), torch.sigmoid(self.categories(features))
+
+
+def test_int8_quarters_the_weights_and_keeps_the_predictions():
+    """Dynamic int8 should shrink the Linear weights about 4x with close outputs"""
+    model = TwoHeads().eval()
+    quantized = quantize(model, INT8)
+
+    report = parity_report(model, quantized, [torch.randn(16, 64) for _ in range(4)])
+
+    assert quantize(model, FLOAT32) is model
+    assert isinstance(model.trunk, torch.nn.Linear)
+    assert model_nbytes(quantized) < 0.3 * model_nbytes(model)
+    assert report["nbytes"] == {
+        "reference": model_nbytes(model),
+        "candidate": model_nbytes(quantized),
+    }
+    assert report["images"] == 64
+    assert report["category_agreement"] >= 0.9
+    assert report["max_abs_error"]["categories"] < 0.05
+
+
+def test_unknown_precision_is_rejected():
+    with pytest.raises(ValueError):
+        quantize(TwoHeads(), "int4")
@@ -0,0 +1,55 @@
+"""Unit tests for the model registry"""
+import torch
+
+from registry import ModelRegistry, model_fingerprint, model_nbytes
+
+
+def linear_loader(calls):
+    def load(model_uri):
+        calls.append(model_uri)
+        return torch.nn.Linear(16, 16)
+
+    return load
+
+
+def test_registry_loads_once_in_eval_mode():
+    """Repeated lookups should reuse the same model instance"""
+    calls = []
+    registry = ModelRegistry(max_bytes=1024**2, loader=linear_loader(calls))
+
+    model = registry.get("models:/fashionnet/1")
+
+    assert registry.get("models:/fashionnet/1") is model
+    assert not model.training
+    assert calls == ["models:/fashionnet/1"]
+
+
+def test_registry_evicts_least_recently_used():
+    """Going over the memory cap should drop the model used longest ago"""
+    calls = []
+    nbytes = model_nbytes(torch.nn.Linear(16, 16))
+    registry = ModelRegistry(max_bytes=2 * nbytes, loader=linear_loader(calls))
+
+    registry.get("v1")
+    registry.get("v2")
+    registry.get("v1")
+    registry.get("v3")
+
+    assert "v1" in registry and "v3" in registry
+    assert "v2" not in registry
+    assert registry.nbytes() == 2 * nbytes
+
+
+def test_registry_versions_models_by_their_weights():
+    """Differently initialised models get different versions, which follow weight changes"""
+    registry = ModelRegistry(max_bytes=1024**2, loader=lambda uri: torch.nn.Linear(16, 16))
+
+    model, version = registry.get_versioned("v1")
+    _, other_version = registry.get_versioned("v2")
+
+    assert registry.get_versioned("v1") == (model, version)
+    assert version != other_version
+    assert model_fingerprint(model) == version
+    with torch.no_grad():
+        model.weight[0, 0] += 1
+    assert model_fingerprint(model) != version
@@ -0,0 +1,133 @@
+"""Background MLflow artifact logging for inference runs"""
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import mlflow
+from mlflow.tracking import MlflowClient
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_STOP = object()
+
+
+class ArtifactLogger:
+    """
+    Stages run artifacts in a local temporary directory and uploads them from a background thread.
+
+    Images are staged under `images/` and prediction dicts under `inferences/`. Staged files are
+    uploaded with a single `log_artifacts` call when the logger is closed, or every `chunk_size`
+    images when `chunk_size` is positive. Logging calls only enqueue work, so callers only wait on
+    the tracking server once `max_pending` artifacts are waiting to be staged. Upload errors are
+    raised by `close`, or by the `with` block unless it is already raising an error of its own.
+
+    :param run_id: MLflow run receiving the artifacts
+    :param chunk_size: number of images per upload, 0 to upload everything at once
+    :param read_back: load every artifact back from the tracking server after uploading it
+    :param max_pending: most artifacts waiting to be staged
+    """
+
+    def __init__(
+        self, run_id: str, chunk_size: int = 0, read_back: bool = False, max_pending: int = 256
+    ):
+        self._run_id = run_id
+        self._chunk_size = chunk_size
+        self._read_back = read_back
+        self._client = MlflowClient()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._root = Path(tempfile.mkdtemp(prefix=f"artifacts-{run_id}-"))
+        self._staged = []
+        self._staged_images = 0
+        self._chunk = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # the error of the block matters more than the upload one
+        try:
+            self.close()
+        except Exception:  # pylint: disable=broad-except
+            logger.warning("Artifacts of run %s were not all uploaded", self._run_id)
+
+    def log_image_bytes(self, image_bytes: bytes, artifact_file: str) -> None:
+        """Logs an already encoded image, e.g. `images/<name>.jpg`."""
+        self._queue.put((artifact_file, image_bytes))
+
+    def log_dict(self, dictionary: dict, artifact_file: str) -> None:
+        """Logs a dict as json, e.g. `inferences/<name>.json`."""
+        self._queue.put((artifact_file, dictionary))
+
+    def close(self) -> None:
+        """Uploads whatever is still staged and waits for the background thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+        shutil.rmtree(self._root, ignore_errors=True)
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._upload()
+                return
+            if self._error is not None:
+                continue
+            try:
+                self._stage(*item)
+                if 0 < self._chunk_size <= self._staged_images:
+                    self._upload()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception("Failed to log artifacts for run %s", self._run_id)
+                self._error = error
+
+    def _chunk_dir(self) -> Path:
+        return self._root / str(self._chunk)
+
+    def _stage(self, artifact_file: str, payload) -> None:
+        path = self._chunk_dir() / artifact_file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(payload, bytes):
+            path.write_bytes(payload)
+            self._staged_images += 1
+        else:
+            path.write_text(json.dumps(payload))
+        self._staged.append(artifact_file)
+
+    def _upload(self) -> None:
+        if self._error is not None or not self._staged:
+            return
+        try:
+            self._client.log_artifacts(self._run_id, str(self._chunk_dir()))
+            logger.info("Uploaded %d artifacts for run %s", len(self._staged), self._run_id)
+            if self._read_back:
+                self._load_back()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.exception("Failed to upload artifacts for run %s", self._run_id)
+            self._error = error
+        shutil.rmtree(self._chunk_dir(), ignore_errors=True)
+        self._staged = []
+        self._staged_images = 0
+        self._chunk += 1
+
+    def _load_back(self) -> None:
+        artifact_uri = self._client.get_run(self._run_id).info.artifact_uri
+        for artifact_file in self._staged:
+            if artifact_file.endswith(".json"):
+                mlflow.artifacts.load_dict(f"{artifact_uri}/{artifact_file}")
+            else:
+                mlflow.artifacts.load_image(f"{artifact_uri}/{artifact_file}")
@@ -1,32 +1,48 @@
 """Helper for inference"""
 from __future__ import annotations
 
-from io import BytesIO
+import os
+import time
+from typing import Optional
 
 import albumentations as A
-import numpy as np
-from PIL import Image
+import torch
 from albumentations.pytorch import ToTensorV2
-from google.cloud import storage
 from torch.utils.data import Dataset
 
+from common.images import decode_image
+from common.storage import get_gateway
+
+IMAGE_SIZE = (224, 224)
+TRANSFORM = A.Compose([A.Resize(*IMAGE_SIZE), ToTensorV2()])
+# versions cached predictions along with the model, bump it whenever decoding or TRANSFORM change
+PREPROCESSING_VERSION = f"p1-{IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}"
+# (minimum, maximum) of the DataLoader options a task may set, larger values are clamped
+LOADER_LIMITS = {
+    "batch_size": (1, int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 256))),
+    "num_workers": (0, int(os.getenv("INFERENCE_MAX_NUM_WORKERS", os.cpu_count() or 1))),
+    "prefetch_factor": (1, int(os.getenv("INFERENCE_MAX_PREFETCH_FACTOR", 8))),
+}
+
 
 def download_blob_into_memory(bucket_name, blob_name):
     """Downloads a blob into memory."""
-    storage_client = storage.Client()
-
-    bucket = storage_client.bucket(bucket_name)
+    return get_gateway().download(bucket_name, blob_name)
 
-    blob = bucket.blob(blob_name)
-    contents = blob.download_as_bytes()
 
-    return contents
+class ImagesDataset(Dataset):
+    """
+    Downloads and transforms task images.
 
+    Items are `(image, image_name, image_bytes, timings)`: the raw bytes are handed back with the
+    tensor so callers never have to fetch the same blob again. Images are decoded near their target
+    size and stay uint8 tensors, which batches turn into floats with `to_float`. `timings` holds the
+    seconds spent in the `download` and `decode` stages, measured wherever the item is loaded, so
+    they reach the task even from DataLoader worker processes.
+    """
 
-class ImagesDataset(Dataset):
     def __init__(self, images_filepaths: list[str], device: str = "cpu"):
         self._images_filepaths = images_filepaths
-        self._transform = A.Compose([A.Resize(224, 224), ToTensorV2()])
         self._device = device
 
     def __len__(self) -> int:
@@ -35,10 +51,49 @@ class ImagesDataset(Dataset):
     def __getitem__(self, idx: int):
         image_name = self._images_filepaths[idx]
         bucket_name = "tcc-clothes"
+        start = time.perf_counter()
         img = download_blob_into_memory(bucket_name, image_name)
-        image = np.asarray(Image.open(BytesIO(img))).astype(np.float32)
+        downloaded = time.perf_counter()
+        image = prepare_image(img)
+        timings = {"download": downloaded - start, "decode": time.perf_counter() - downloaded}
+        return image.to(self._device), image_name, img, timings
+
+
+def prepare_image(image_bytes: bytes) -> torch.Tensor:
+    """Decodes and resizes an encoded image into the uint8 CHW tensor the model takes."""
+    image = decode_image(image_bytes, size=IMAGE_SIZE)
+    return TRANSFORM(image=image)["image"]
+
+
+def dataloader_options(payload: dict, defaults: dict, limits: Optional[dict] = None) -> dict:
+    """
+    Builds the DataLoader arguments for a task.
+
+    Each option can be set in the inference payload and falls back to the worker defaults. Values
+    above their limit are clamped to it, prefetching only applies when images are loaded in worker
+    processes.
+
+    :param payload: inference task payload
+    :param defaults: value of every option when the payload does not set it
+    :param limits: (minimum, maximum) of every option, `LOADER_LIMITS` by default
+    :return: keyword arguments for DataLoader
+    :raises ValueError: when an option is not an integer or is below its minimum
+    """
+    limits = limits or LOADER_LIMITS
+    options = {}
+    for key, default in defaults.items():
+        value = payload[key] if payload.get(key) is not None else default
+        minimum, maximum = limits[key]
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"{key} must be an integer, got {value!r}")
+        if value < minimum:
+            raise ValueError(f"{key} must be at least {minimum}, got {value}")
+        options[key] = min(value, maximum)
+    if options["num_workers"] == 0:
+        options.pop("prefetch_factor")
+    return options
 
-        if self._transform:
-            image = self._transform(image=image)["image"]
 
-        return image.to(self._device), image_name
+def to_float(images: torch.Tensor) -> torch.Tensor:
+    """Converts a batch of uint8 images into the float32 [0, 255] tensors the model expects."""
+    return images.to(torch.float32)
@@ -0,0 +1,41 @@
+"""Postprocessing of model outputs, for whole batches at once"""
+from __future__ import annotations
+
+import numpy as np
+import torch
+
+from utils.categories_mapping import master_categories
+
+# (output column, field prefix) of the vectors top-k predictions are made for
+TOP_K_COLUMNS = (("categories", "top_category"), ("massive_attr", "top_attribute"))
+
+
+def postprocess(vectors: dict, top_k: int = 0) -> list[dict]:
+    """
+    Turns the outputs of a batch into the prediction fields of each image.
+
+    Every image gets its best category, `category_prediction_index` and `category_prediction`.
+    With `top_k`, it also gets its `top_k` best categories and attributes, best first, as
+    `top_category_indices`, `top_category_scores` and `top_categories` (their names), and
+    `top_attribute_indices` and `top_attribute_scores`.
+
+    :param vectors: float32 matrix of the batch for the `categories` and `massive_attr` outputs
+    :param top_k: number of best categories and attributes to report, none when 0
+    :return: prediction fields of every image of the batch
+    """
+    best = np.argmax(vectors["categories"], axis=1).tolist()
+    fields = {
+        "category_prediction_index": best,
+        "category_prediction": [master_categories[index] for index in best],
+    }
+    if top_k:
+        for column, prefix in TOP_K_COLUMNS:
+            matrix = torch.from_numpy(np.ascontiguousarray(vectors[column]))
+            scores, indices = torch.topk(matrix, min(top_k, matrix.shape[1]), dim=1)
+            fields[f"{prefix}_indices"] = indices.tolist()
+            fields[f"{prefix}_scores"] = scores.tolist()
+        fields["top_categories"] = [
+            [master_categories[index] for index in indices]
+            for indices in fields["top_category_indices"]
+        ]
+    return [dict(zip(fields, values)) for values in zip(*fields.values())]